@@ -1,3 +1,4 @@
+from bisect import bisect_right
 from typing import List
 from enum import Enum
 
@@ -11,6 +12,71 @@ class Operation(Enum):
     CONCAT = 7
     PROTECTION = 8
 
+MAX_CODE = 0x10FFFF
+
+
+class CharClass:
+    """Set of characters kept as sorted, disjoint code point ranges (lo, hi).
+
+    Used as the root of a leaf RegExTree for `[...]`, `[^...]` and `.`.
+    """
+
+    def __init__(self, ranges, negated: bool = False):
+        merged = []
+        for lo, hi in sorted(ranges):
+            if merged and lo <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+            else:
+                merged.append((lo, hi))
+        if negated:
+            complement = []
+            start = 0
+            for lo, hi in merged:
+                if lo > start:
+                    complement.append((start, lo - 1))
+                start = hi + 1
+            if start <= MAX_CODE:
+                complement.append((start, MAX_CODE))
+            merged = complement
+        self.ranges = tuple(merged)
+        self.negated = negated
+        self.starts = [lo for lo, _ in merged]
+
+    def __contains__(self, char) -> bool:
+        i = bisect_right(self.starts, ord(char)) - 1
+        return i >= 0 and ord(char) <= self.ranges[i][1]
+
+    def __len__(self) -> int:
+        return sum(hi - lo + 1 for lo, hi in self.ranges)
+
+    def __eq__(self, other):
+        return isinstance(other, CharClass) and self.ranges == other.ranges
+
+    def __hash__(self):
+        return hash(self.ranges)
+
+    def chars(self) -> List[str]:
+        return [chr(code) for lo, hi in self.ranges for code in range(lo, hi + 1)]
+
+    def __str__(self):
+        ranges = self.ranges
+        prefix = "["
+        if self.negated:
+            ranges = CharClass(ranges, negated=True).ranges
+            prefix = "[^"
+        parts = [chr(lo) if lo == hi else f"{chr(lo)}-{chr(hi)}" for lo, hi in ranges]
+        return prefix + "".join(parts).replace("\n", "\\n") + "]"
+
+
+ANY_BUT_NEWLINE = CharClass([(ord("\n"), ord("\n"))], negated=True)  # what `.` matches
+
+
+class RegExSyntaxError(Exception):
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} at position {position}")
+        self.position = position
+
+
 class RegExTree:
     def __init__(self, root: Operation, subTrees: List['RegExTree'] = []):
         self.root = root
@@ -31,12 +97,22 @@ class RegExTree:
             return str(self.root)
 
     def __str__(self):
-        if self.subTrees == []:
-            return self.rootToString()
-        result = self.rootToString() + "(" + self.subTrees[0].__str__()
-        for i in range(1, len(self.subTrees)):
-            result += "," + self.subTrees[i].__str__()
-        return result + ")"
+        parts = []
+        stack = [self]  # trees still to print, and the "," / ")" between them
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                parts.append(item)
+                continue
+            parts.append(item.rootToString())
+            if item.subTrees:
+                parts.append("(")
+                stack.append(")")
+                for i in range(len(item.subTrees) - 1, 0, -1):
+                    stack.append(item.subTrees[i])
+                    stack.append(",")
+                stack.append(item.subTrees[0])
+        return "".join(parts)
 
 
 
@@ -192,16 +268,22 @@ class RegEx:
     """
 
     def removeProtection(self, tree: RegExTree) -> RegExTree:
-        if tree.root == Operation.PROTECTION and len(tree.subTrees) != 1:
-            raise Exception("Protection node must have exactly one subtree")
-        if not tree.subTrees:
-            return tree
-        if tree.root == Operation.PROTECTION:
-            return self.removeProtection(tree.subTrees[0])
-        subTrees = []
-        for t in tree.subTrees:  # fixed
-            subTrees.append(self.removeProtection(t))
-        return RegExTree(tree.root, subTrees)
+        results = []  # rebuilt subtrees, in postorder
+        stack = [(tree, False)]
+        while stack:
+            t, done = stack.pop()
+            if t.root == Operation.PROTECTION and len(t.subTrees) != 1:
+                raise Exception("Protection node must have exactly one subtree")
+            if not t.subTrees:
+                results.append(t)
+            elif not done:
+                stack.append((t, True))
+                stack.extend((sub, False) for sub in reversed(t.subTrees))
+            elif t.root != Operation.PROTECTION:  # a protection is replaced by its subtree
+                subTrees = results[len(results) - len(t.subTrees):]
+                del results[len(results) - len(t.subTrees):]
+                results.append(RegExTree(t.root, subTrees))
+        return results[0]
 
     # Parse list of RegExTree nodes
     def parseList(self, trees: List[RegExTree]) -> RegExTree:
@@ -219,10 +301,111 @@ class RegEx:
             raise Exception("Parsing did not produce a single tree")
         return self.removeProtection(trees[0])
 
-    def parse(self) -> RegExTree:
+    def parseLegacy(self) -> RegExTree:
+        """Multi-pass parser (one contain/process pass per folded operator)."""
         trees = [RegExTree(self.chartoRoot(c)) for c in self.regex]
         return self.parseList(trees)
 
+    def parse(self) -> RegExTree:
+        """Single left-to-right pass building the same tree as parseLegacy.
+
+        Each open group is a frame [alternative, concat, last atom, position]
+        on an explicit stack, so nesting depth is not limited by recursion.
+        """
+        frames = [[None, None, None, -1]]
+        i = 0
+        while i < len(self.regex):
+            c = self.regex[i]
+            frame = frames[-1]
+            root = self.chartoRoot(c)
+            if c == "[":
+                charClass, i = self.parseClass(i)
+                self.pushAtom(frame, RegExTree(charClass))
+            elif root == Operation.PARENTHESE_L:
+                frames.append([None, None, None, i])
+            elif root == Operation.PARENTHESE_R:
+                if len(frames) == 1:
+                    raise RegExSyntaxError("Mismatched parentheses", i)
+                group = self.closeFrame(frame, i, "Empty parentheses")
+                frames.pop()
+                self.pushAtom(frames[-1], group)
+            elif root == Operation.ALTERN:
+                branch = self.closeBranch(frame)
+                if branch is None:
+                    raise RegExSyntaxError("Altern without left element", i)
+                frame[0] = branch if frame[0] is None else RegExTree(Operation.ALTERN, [frame[0], branch])
+                frame[1] = None
+            elif root in (Operation.ETOILE, Operation.PLUS):
+                if frame[2] is None:
+                    name = "Etoile" if root == Operation.ETOILE else "Plus"
+                    raise RegExSyntaxError(f"{name} without preceding element", i)
+                frame[2] = RegExTree(root, [frame[2]])
+            else:
+                self.pushAtom(frame, RegExTree(root))
+            i += 1
+        if len(frames) > 1:
+            raise RegExSyntaxError("Closing parenthesis not found", frames[-1][3])
+        return self.closeFrame(frames[0], len(self.regex), "Empty regex")
+
+    CLASS_ESCAPES = {"n": "\n", "t": "\t", "r": "\r"}
+
+    def parseClass(self, start: int):
+        """Parse `[...]` opening at `start`; return (CharClass, index of `]`).
+
+        `^` first negates, `]` first is literal, `a-z` is a range, `-` first
+        or last is literal, and `\\n`, `\\t`, `\\r`, `\\x` escape a character.
+        """
+        i = start + 1
+        negated = i < len(self.regex) and self.regex[i] == "^"
+        if negated:
+            i += 1
+        chars = []  # (char, escaped)
+        while i < len(self.regex) and (self.regex[i] != "]" or not chars):
+            c = self.regex[i]
+            if c == "\\" and i + 1 < len(self.regex):
+                i += 1
+                chars.append((self.CLASS_ESCAPES.get(self.regex[i], self.regex[i]), True))
+            else:
+                chars.append((c, False))
+            i += 1
+        if i >= len(self.regex):
+            raise RegExSyntaxError("Closing bracket not found", start)
+        ranges = []
+        k = 0
+        while k < len(chars):
+            lo = chars[k][0]
+            if k + 2 < len(chars) and chars[k + 1] == ("-", False):
+                hi = chars[k + 2][0]
+                if ord(hi) < ord(lo):
+                    raise RegExSyntaxError(f"Invalid range {lo}-{hi}", start)
+                ranges.append((ord(lo), ord(hi)))
+                k += 3
+            else:
+                ranges.append((ord(lo), ord(lo)))
+                k += 1
+        return CharClass(ranges, negated), i
+
+    def pushAtom(self, frame, atom: RegExTree):
+        frame[1] = self.closeBranch(frame)
+        frame[2] = atom
+
+    def closeBranch(self, frame):
+        concat, last = frame[1], frame[2]
+        frame[2] = None
+        if last is None:
+            return concat
+        return last if concat is None else RegExTree(Operation.CONCAT, [concat, last])
+
+    def closeFrame(self, frame, position: int, emptyMessage: str) -> RegExTree:
+        branch = self.closeBranch(frame)
+        if branch is None:
+            if frame[0] is not None:
+                raise RegExSyntaxError("Altern without right element", position)
+            raise RegExSyntaxError(emptyMessage, position)
+        if frame[0] is None:
+            return branch
+        return RegExTree(Operation.ALTERN, [frame[0], branch])
+
 
 if __name__ == "__main__":
     regex_str = input("Enter a regex: ")
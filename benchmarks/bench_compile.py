@@ -0,0 +1,69 @@
+"""Time of each compilation stage on very large patterns (100k+ tree nodes).
+
+    python benchmarks/bench_compile.py [--words 1000 15000] [--literal 100000]
+
+Patterns are long alternations of random words (as generated from word
+lists) and one long literal, i.e. a left-deep CONCAT chain. Every stage is
+iterative, so none of them may hit Python's recursion limit.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from astTree import RegEx  # noqa: E402
+from glushkov import PositionAutomaton  # noqa: E402
+from nfa import NFA, CompiledNFA  # noqa: E402
+from optimize import count_nodes, optimize  # noqa: E402
+from search import reverse_tree  # noqa: E402
+
+
+def words(count: int, seed=0):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+            for _ in range(count)]
+
+
+def timed(stage, *args):
+    if None in args:
+        return None, "-"  # an earlier stage failed
+    start = time.perf_counter()
+    try:
+        result = stage(*args)
+    except RecursionError:
+        return None, "RecursionError"
+    return result, f"{time.perf_counter() - start:.3f}s"
+
+
+def bench(name, regex):
+    tree, parse_time = timed(RegEx(regex).parse)
+    nfa, nfa_time = timed(NFA.tree_to_nfa, tree)
+    times = [parse_time, timed(str, tree)[1], timed(optimize, tree)[1], nfa_time, timed(CompiledNFA, nfa)[1],
+             timed(reverse_tree, tree)[1], timed(PositionAutomaton, tree)[1]]
+    nodes = count_nodes(tree) if tree is not None else "-"
+    print(f"{name:>14} {nodes:>8}" + "".join(f" {t:>10}" for t in times))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, nargs="+", default=[1000, 15000],
+                        help="sizes of the word alternations")
+    parser.add_argument("--literal", type=int, nargs="+", default=[100000],
+                        help="lengths of the literal patterns")
+    args = parser.parse_args(argv)
+
+    stages = ["parse", "str", "optimize", "tree_to_nfa", "CompiledNFA", "reverse", "Glushkov"]
+    print(f"{'pattern':>14} {'nodes':>8}" + "".join(f" {s:>10}" for s in stages))
+    for count in args.words:
+        bench(f"{count} words", "|".join(words(count)))
+    for length in args.literal:
+        text = "".join(words(length // 3 + 1, seed=1))[:length]
+        bench(f"{length} chars", text)
+
+
+if __name__ == "__main__":
+    main()
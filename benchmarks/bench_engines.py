@@ -0,0 +1,369 @@
+"""Compile time, match throughput and memory of the NFA, DFA and `re` engines.
+
+    python benchmarks/bench_engines.py [--sizes 1M 100M 1G] [--families literal blowup]
+                                       [-o results.json] [--baseline baseline.json]
+
+Corpora are synthetic Gutenberg-like English books (chapters, paragraphs
+wrapped at 72 columns, dialogue, a Zipf-distributed vocabulary), generated
+once per size and seed in --corpus-dir. Every pattern of each family is
+compiled stage by stage (parse, tree_to_nfa, nfa_to_dfa, dfa_table: the
+best of --repeat runs), its peak memory measured with tracemalloc, then
+each engine tells which lines contain a match:
+
+    re       re.search, the baseline
+    dfa      DFATable.search, the search DFA of the pattern
+    nfa      CompiledNFA.match of .*(pattern).*, bitset NFA simulation
+    search   search.compile(...).contains: literals, prefilter, DFA fallbacks
+
+Each engine reads the corpus for at most --time-limit seconds (reading
+excluded); throughput is the MB scanned by second. Results go to -o as
+JSON; with --baseline, timings worse than the baseline's by more than
+--tolerance and changed state counts are reported, and the exit status
+is 1 if there are any.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import search  # noqa: E402
+from astTree import RegEx  # noqa: E402
+from dfa import ClassMap, DFATable  # noqa: E402
+from egrep import iter_blocks  # noqa: E402
+from nfa import NFA, CompiledNFA, DFATooLarge  # noqa: E402
+
+UNITS = {"K": 10 ** 3, "M": 10 ** 6, "G": 10 ** 9}
+STAGES = ("parse", "tree_to_nfa", "nfa_to_dfa", "dfa_table")
+ENGINES = ("re", "dfa", "nfa", "search")
+SAMPLE_LINES = 2000  # lines every engine is checked on against re
+MIN_DELTA = 0.001  # seconds: smaller differences of compile time are noise
+
+COMMON = ("the of and to a in that was he it his with as had for you not be her is on at by which but "
+          "have from this him she they all were my so one said there we no an or when what their been "
+          "would up out if them more into who could upon little very then now some any our man").split()
+NAMES = ("Holmes", "Watson", "Lestrade", "Ahab", "Ishmael", "Elizabeth", "Darcy", "Bennet")
+ONSETS = ("b", "c", "d", "f", "g", "h", "l", "m", "n", "p", "r", "s", "t", "w", "br", "ch", "cr", "gr",
+          "pl", "sh", "st", "th", "tr", "wh")
+VOWELS = ("a", "e", "i", "o", "u", "ea", "ou", "ai", "ee", "oo")
+CODAS = ("", "", "n", "r", "s", "t", "d", "l", "ng", "st", "th", "ck", "nd", "rt")
+SUFFIXES = ("", "", "", "s", "ed", "ing", "ly", "ness", "er")
+
+
+def vocabulary(size=6000, seed=0):
+    """Common English words followed by `size` invented ones, by decreasing frequency."""
+    rng = random.Random(seed)
+    words = list(COMMON)
+    seen = set(words)
+    while len(words) < len(COMMON) + size:
+        word = "".join(rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(CODAS)
+                       for _ in range(rng.choice((1, 1, 2, 2, 3)))) + rng.choice(SUFFIXES)
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def roman(n: int) -> str:
+    digits = ((1000, "M"), (900, "CM"), (500, "D"), (400, "CD"), (100, "C"), (90, "XC"),
+              (50, "L"), (40, "XL"), (10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I"))
+    out = ""
+    for value, digit in digits:
+        while n >= value:
+            out += digit
+            n -= value
+    return out
+
+
+def wrap(text: str, width=72):
+    line = []
+    length = 0
+    for word in text.split(" "):
+        if line and length + 1 + len(word) > width:
+            yield " ".join(line)
+            line, length = [], -1
+        line.append(word)
+        length += 1 + len(word)
+    if line:
+        yield " ".join(line)
+
+
+def generate_book(out, size: int, seed=0):
+    """Write about `size` bytes of Gutenberg-like ASCII text to the text file `out`."""
+    rng = random.Random(seed)
+    words = vocabulary(seed=seed)
+    weights = [1 / (rank + 1) for rank in range(len(words))]  # Zipf's law
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    written = 0
+    chapter = 0
+
+    def emit(text):
+        nonlocal written
+        out.write(text)
+        written += len(text)
+
+    emit(f"The Project Gutenberg EBook of The {rng.choice(NAMES)} Papers, seed {seed}\n\n")
+    while written < size:
+        if chapter == 0 or rng.random() < 0.01:
+            chapter += 1
+            emit(f"\nCHAPTER {roman(chapter)}.\n\n")
+        sentences = []
+        for _ in range(rng.randint(2, 8)):
+            sentence = rng.choices(words, cum_weights=cumulative, k=rng.randint(4, 24))
+            if rng.random() < 0.3:
+                sentence[rng.randrange(len(sentence))] = rng.choice(NAMES)
+            if len(sentence) > 8 and rng.random() < 0.4:
+                sentence[rng.randrange(1, len(sentence) - 1)] += ","
+            text = " ".join(sentence)
+            text = text[0].upper() + text[1:] + rng.choice(".....!?;")
+            if rng.random() < 0.15:
+                text = f'"{text}" said {rng.choice(NAMES)}.'
+            sentences.append(text)
+        emit("\n".join(wrap(" ".join(sentences))) + "\n\n")
+
+
+def parse_size(text: str) -> int:
+    unit = UNITS.get(text[-1:].upper())
+    return int(float(text[:-1]) * unit) if unit else int(text)
+
+
+def corpus_path(directory: str, size_label: str, seed=0) -> str:
+    """Path of the corpus of that size, generated on first use."""
+    path = os.path.join(directory, f"book-{size_label}-{seed}.txt")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding="ascii") as out:
+            generate_book(out, parse_size(size_label), seed)
+        os.replace(temporary, path)
+    return path
+
+
+def families(seed=0):
+    """Pattern families: {family: [regex, ...]} in the syntax of RegEx."""
+    words = vocabulary(seed=seed)
+    return {
+        "literal": ["the", "Holmes", words[len(COMMON) + 50], "said Watson"],
+        "alternation": ["Holmes|Watson",
+                        "|".join(NAMES),
+                        "|".join(words[len(COMMON) + 100:len(COMMON) + 200])],
+        "nested": ["((a|e)[a-z]*(s|d) )+",
+                   "(w(h|a)(a|e|i)*t)*ever",
+                   "([A-Z][a-z]* )*said",
+                   "((th(e|o)*)+(r|se)*[a-z])*ing"],
+        # an e n + 1 characters before a space: about 2**(n+1) DFA states
+        "blowup": [f"[a-z]*e{'[a-z]' * n} " for n in (4, 8, 12, 16)],
+    }
+
+
+def best_time(function, *args, repeat=3):
+    """(result, best time over `repeat` calls) of function(*args)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def determinize(nfa, max_states):
+    starts, ids, representatives = NFA.get_classes(nfa)
+    dfa_start, dfa_accepts = nfa.nfa_to_dfa(representatives[1:], search=True, max_states=max_states)
+    return dfa_start, dfa_accepts, representatives[1:], ClassMap(starts, ids)
+
+
+def dfa_table(dfa_start, dfa_accepts, alphabet, classes):
+    return DFATable.from_states(dfa_start, dfa_accepts, alphabet, True, classes).merge_classes()
+
+
+def compile_stages(regex: str, max_states: int, repeat: int) -> dict:
+    """Times of the compilation stages, state counts and the automata of `regex`."""
+    result = {"times": {}, "nfa_states": None, "dfa_states": None, "error": None}
+    times = result["times"]
+    tree, times["parse"] = best_time(RegEx(regex).parse, repeat=repeat)
+    nfa, times["tree_to_nfa"] = best_time(NFA.tree_to_nfa, tree, repeat=repeat)
+    result["nfa_states"] = CompiledNFA(nfa).n_states
+    try:
+        determinized, times["nfa_to_dfa"] = best_time(determinize, nfa, max_states, repeat=repeat)
+    except DFATooLarge as e:
+        result["error"] = str(e)
+        return result
+    table, times["dfa_table"] = best_time(dfa_table, *determinized, repeat=repeat)
+    result["dfa_states"] = table.n_states
+    result["dfa"] = table
+    return result
+
+
+def peak_memory(regex: str, max_states: int) -> int:
+    """Peak bytes allocated while compiling `regex` to its DFA table."""
+    tracemalloc.start()
+    try:
+        nfa = NFA.tree_to_nfa(RegEx(regex).parse())
+        dfa_table(*determinize(nfa, max_states))
+    except DFATooLarge:
+        pass
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return peak
+
+
+def matchers(regex: str, compiled: dict, max_states: int) -> dict:
+    """engine -> function telling whether a line contains a match of `regex`."""
+    found = {"re": re.compile(regex).search,
+             "nfa": CompiledNFA(NFA.tree_to_nfa(RegEx(f".*({regex}).*").parse())).match,
+             "search": search.compile(regex, max_states=max_states).contains}
+    if "dfa" in compiled:
+        found["dfa"] = compiled["dfa"].search
+    return found
+
+
+def throughput(contains, path: str, time_limit: float) -> dict:
+    """MB/s of `contains` over the lines of `path`, read for at most `time_limit` seconds."""
+    scanned = matched = 0
+    elapsed = 0.0
+    with open(path, encoding="ascii") as stream:
+        for text, lines in iter_blocks(stream):
+            start = time.perf_counter()
+            matched += sum(1 for line in lines if contains(line))
+            elapsed += time.perf_counter() - start
+            scanned += len(text) + 1
+            if elapsed >= time_limit:
+                break
+    return {"mb_per_s": round(scanned / elapsed / 1e6, 3) if elapsed else None,
+            "bytes": scanned, "matched_lines": matched}
+
+
+def sample_lines(path: str):
+    lines = []
+    with open(path, encoding="ascii") as stream:
+        for line in stream:
+            lines.append(line.rstrip("\n"))
+            if len(lines) == SAMPLE_LINES:
+                break
+    return lines
+
+
+def bench_pattern(family, regex, path, size_label, args) -> dict:
+    compiled = compile_stages(regex, args.max_states, args.repeat)
+    record = {"key": f"{size_label}/{family}/{regex}", "family": family, "pattern": regex,
+              "corpus": size_label, "compile": compiled["times"], "nfa_states": compiled["nfa_states"],
+              "dfa_states": compiled["dfa_states"], "error": compiled["error"],
+              "peak_memory": peak_memory(regex, args.max_states), "engines": {}}
+    functions = matchers(regex, compiled, args.max_states)
+    sample = sample_lines(path)
+    expected = [bool(functions["re"](line)) for line in sample]
+    for engine in args.engines:
+        if engine not in functions:
+            continue  # no DFA under --max-states
+        contains = functions[engine]
+        result = throughput(contains, path, args.time_limit)
+        result["agrees_with_re"] = [bool(contains(line)) for line in sample] == expected
+        record["engines"][engine] = result
+    return record
+
+
+def compare(results, baseline, tolerance) -> list:
+    """Regressions of `results` with respect to `baseline`, as printable lines."""
+    previous = {record["key"]: record for record in baseline["results"]}
+    regressions = []
+    for record in results["results"]:
+        old = previous.get(record["key"])
+        if old is None:
+            continue
+        for stage, seconds in record["compile"].items():
+            before = old["compile"].get(stage)
+            if before is not None and seconds > before * (1 + tolerance) and seconds - before > MIN_DELTA:
+                regressions.append(f"{record['key']}: {stage} {before:.4f}s -> {seconds:.4f}s")
+        for count in ("nfa_states", "dfa_states"):
+            if record[count] != old[count]:
+                regressions.append(f"{record['key']}: {count} {old[count]} -> {record[count]}")
+        if record["peak_memory"] > old["peak_memory"] * (1 + tolerance):
+            regressions.append(f"{record['key']}: peak memory {old['peak_memory']} -> {record['peak_memory']} bytes")
+        for engine, result in record["engines"].items():
+            before = old["engines"].get(engine, {}).get("mb_per_s")
+            now = result["mb_per_s"]
+            if before and now and now * (1 + tolerance) < before:
+                regressions.append(f"{record['key']}: {engine} {before:.2f} -> {now:.2f} MB/s")
+            if not result["agrees_with_re"]:
+                regressions.append(f"{record['key']}: {engine} disagrees with re")
+    return regressions
+
+
+def report(record):
+    times = "".join(f" {record['compile'][stage] * 1000:>9.2f}" if stage in record["compile"] else f" {'-':>9}"
+                    for stage in STAGES)
+    states = f"{record['nfa_states']:>6} {record['dfa_states'] if record['dfa_states'] is not None else '>max':>6}"
+    speeds = ""
+    for engine in ENGINES:
+        result = record["engines"].get(engine)
+        speed = f"{result['mb_per_s']:.2f}" + ("" if result["agrees_with_re"] else "!") if result else "-"
+        speeds += f" {speed:>8}"
+    # runs of [a-z] shown as [a-z]{n} (the RegEx syntax has no counted repetition)
+    pattern = re.sub(r"(?:\[a-z\]){2,}", lambda m: f"[a-z]{{{len(m.group()) // 5}}}", record["pattern"])
+    pattern = pattern if len(pattern) <= 24 else pattern[:21] + "..."
+    print(f"{record['corpus']:>5} {record['family']:>11} {pattern:<24}{times} {states}"
+          f" {record['peak_memory'] // 1024:>8}{speeds}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=["1M"], help="corpus sizes (suffixes K, M, G), up to 1G")
+    parser.add_argument("--families", nargs="+", choices=sorted(families()), default=sorted(families()))
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "regex-bench"),
+                        help="where generated corpora are kept between runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-limit", type=float, default=2.0, help="seconds of matching per engine and pattern")
+    parser.add_argument("--repeat", type=int, default=3, help="compilations timed per stage (the best is kept)")
+    parser.add_argument("--max-states", type=int, default=10000, help="DFA state budget")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    patterns = families(args.seed)
+    results = {"python": platform.python_version(), "platform": platform.platform(),
+               "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "time_limit": args.time_limit,
+               "max_states": args.max_states, "results": []}
+
+    print(f"{'size':>5} {'family':>11} {'pattern':<24}" + "".join(f" {stage[:9]:>9}" for stage in STAGES)
+          + f" {'NFA':>6} {'DFA':>6} {'peak KB':>8}" + "".join(f" {engine:>8}" for engine in ENGINES))
+    print(f"{'':>41} (compile times in ms){'':>33} (MB/s; ! disagrees with re)")
+    for size_label in args.sizes:
+        path = corpus_path(args.corpus_dir, size_label, args.seed)
+        for family in args.families:
+            for regex in patterns[family]:
+                record = bench_pattern(family, regex, path, size_label, args)
+                results["results"].append(record)
+                report(record)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
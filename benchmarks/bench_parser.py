@@ -0,0 +1,50 @@
+"""Parse time of RegEx.parse (single pass) vs RegEx.parseLegacy (multi pass).
+
+    python benchmarks/bench_parser.py [--terms 100 1000 10000] [--legacy-max 3000]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from astTree import RegEx  # noqa: E402
+
+
+def alternation(terms: int, seed=0) -> str:
+    """'w1|w2|...' over `terms` random lowercase words."""
+    rng = random.Random(seed)
+    words = ("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+             for _ in range(terms))
+    return "|".join(words)
+
+
+def timed(parse):
+    start = time.perf_counter()
+    try:
+        parse()
+    except RecursionError:
+        return "RecursionError"
+    return f"{time.perf_counter() - start:.4f}s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--terms", type=int, nargs="+", default=[100, 1000, 3000, 10000])
+    parser.add_argument("--legacy-max", type=int, default=3000,
+                        help="largest term count given to the quadratic legacy parser")
+    args = parser.parse_args(argv)
+
+    print(f"{'terms':>7} {'chars':>8} {'parse':>10} {'parseLegacy':>15}")
+    for terms in args.terms:
+        regex = alternation(terms)
+        new = timed(RegEx(regex).parse)
+        old = timed(RegEx(regex).parseLegacy) if terms <= args.legacy_max else "skipped"
+        print(f"{terms:>7} {len(regex):>8} {new:>10} {old:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import search
+from astTree import RegEx
+from dfa import DFATable
+from glushkov import PositionAutomaton
+from literal import LiteralPattern
+from optimize import optimize
+
+PATTERN_MAGIC = b"DPAT"
+PATTERN_VERSION = 1
+BLOB_SIZE = struct.Struct("<I")
+
+DEFAULT_MAX_BYTES = 64 << 20
+
+
+def dump_pattern(pattern, search_only=False) -> bytes:
+    """Serialize a compiled pattern: JSON metadata then the DFA table blobs.
+
+    Position automata (and a LazyDFA contains table) are stored as empty
+    blobs and rebuilt from the regex as position automata. With
+    `search_only`, only the table of contains() is stored (nor built): the
+    loaded pattern compiles the others on first use.
+    """
+    if isinstance(pattern, LiteralPattern):
+        meta = {"regex": pattern.regex, "kind": "literal", "literals": pattern.literals}
+        tables = []
+    else:
+        groups = pattern.prefilter.groups if pattern.prefilter is not None else []
+        meta = {"regex": pattern.regex, "kind": "dfa", "prefilter": groups}
+        if search_only:
+            meta["max_states"] = pattern.max_states
+            tables = [pattern.contains_dfa]
+        else:
+            tables = [pattern.contains_dfa, *pattern._tables()]
+    parts = [PATTERN_MAGIC, struct.pack("<H", PATTERN_VERSION)]
+    tables = [t.to_bytes() if isinstance(t, DFATable) else b"" for t in tables]
+    for blob in [json.dumps(meta).encode("utf-8")] + tables:
+        parts.append(BLOB_SIZE.pack(len(blob)))
+        parts.append(blob)
+    return b"".join(parts)
+
+
+def load_pattern(data):
+    data = memoryview(data)
+    if bytes(data[:4]) != PATTERN_MAGIC or struct.unpack_from("<H", data, 4)[0] != PATTERN_VERSION:
+        raise ValueError("Not a compiled pattern (or unsupported version)")
+    blobs = []
+    pos = 6
+    while pos < len(data):
+        (size,) = BLOB_SIZE.unpack_from(data, pos)
+        pos += BLOB_SIZE.size
+        blobs.append(data[pos:pos + size])
+        pos += size
+    meta = json.loads(bytes(blobs[0]).decode("utf-8"))
+    if meta["kind"] == "literal":
+        return LiteralPattern(meta["regex"], meta["literals"])
+    tables = [DFATable.from_bytes(blob) if len(blob) else None for blob in blobs[1:]]
+    if len(tables) == 1:  # dumped with search_only
+        contains_dfa = tables[0]
+        if contains_dfa is None:
+            contains_dfa = PositionAutomaton(optimize(RegEx(meta["regex"]).parse()), search=True)
+        return search.Pattern.from_tables(meta["regex"], contains_dfa, None, None, meta["prefilter"],
+                                          meta["max_states"])
+    if any(t is None for t in tables):
+        tree = optimize(RegEx(meta["regex"]).parse())
+        rebuilt = [PositionAutomaton(tree, search=True), PositionAutomaton(tree),
+                   PositionAutomaton(search.reverse_tree(tree), search=True)]
+        tables = [t if t is not None else r for t, r in zip(tables, rebuilt)]
+    contains_dfa, anchored, reverse = tables
+    return search.Pattern.from_tables(meta["regex"], contains_dfa, anchored, reverse, meta["prefilter"])
+
+
+class PatternCache:
+    """LRU cache of compiled patterns, bounded by their table size in bytes.
+
+    With a `directory`, compiled tables are also written there (one file per
+    pattern and options) so other processes and restarts skip compilation.
+    Lazy patterns are only kept in memory. It can be shared by threads:
+    the entries are guarded by a lock, released while compiling.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()  # key -> (pattern, size)
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".dfa")
+
+    def _load(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                pattern = load_pattern(f.read())
+        except (OSError, ValueError, KeyError):
+            return None
+        return pattern if pattern.regex == key[0] else None
+
+    def _store(self, key, pattern):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(dump_pattern(pattern))
+            os.replace(tmp, path)  # atomic: readers never see a partial file
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _insert(self, key, pattern):
+        if key in self.entries:  # compiled meanwhile by another thread
+            self.size -= self.entries.pop(key)[1]
+        size = pattern.nbytes
+        self.entries[key] = (pattern, size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= evicted
+
+    def compile(self, regex_str: str, minimize=False, lazy=False, max_states=10000, stats=None,
+                glushkov=False):
+        """Same as search.compile, served from the cache when possible.
+
+        `stats` is only filled when the pattern is actually compiled.
+        """
+        key = (regex_str, minimize, lazy, max_states, glushkov)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                pattern = entry[0]
+                # tables built on first use since insertion count from now on
+                if pattern.nbytes != entry[1]:
+                    self._insert(key, pattern)
+                return pattern
+        pattern = None
+        persistent = self.directory is not None and not lazy
+        if persistent:
+            pattern = self._load(key)
+            if pattern is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                if stats is not None:
+                    stats["engine"] = "disk-cache"
+        if pattern is None:
+            with self._lock:
+                self.misses += 1
+            pattern = search.compile(regex_str, minimize, lazy, max_states, stats, glushkov)
+            if persistent:
+                self._store(key, pattern)
+        with self._lock:
+            self._insert(key, pattern)
+        return pattern
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+
+default_cache = PatternCache()
+
+
+def compile(regex_str: str, minimize=False, lazy=False, max_states=10000, stats=None, glushkov=False):
+    """Compile through the process-wide PatternCache."""
+    return default_cache.compile(regex_str, minimize, lazy, max_states, stats, glushkov)
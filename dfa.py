@@ -0,0 +1,451 @@
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+from nfa import NFA, ACCEPT
+
+DEAD = 0  # state 0 is always the non-accepting sink
+
+TABLE_MAGIC = b"DFAT"
+TABLE_VERSION = 2
+# magic, version, n_classes, n_states, start, search, number of class intervals
+TABLE_HEADER = struct.Struct("<4sHIIIBI")
+
+
+class _Translation(dict):
+    # str.translate table (code point -> class as a char), filled on first sight
+    def __init__(self, class_map):
+        super().__init__((code, chr(class_map.class_of_code(code))) for code in range(256))
+        self.class_map = class_map
+
+    def __missing__(self, code):
+        value = self[code] = chr(self.class_map.class_of_code(code))
+        return value
+
+
+class ClassMap:
+    """Character -> class id, stored as sorted code point intervals.
+
+    Interval i covers code points starts[i] up to starts[i + 1] - 1 and
+    belongs to class ids[i]; starts[0] is 0, so every character has a class
+    and a range like `[^\\n]` costs two intervals, not a million entries.
+    """
+
+    def __init__(self, starts, ids):
+        self.starts = list(starts)
+        self.ids = list(ids)
+        self.n_classes = max(self.ids) + 1
+        self._translation = None
+
+    @staticmethod
+    def from_chars(classes) -> 'ClassMap':
+        """Build from a {char: class id} dict, every other character in class 0."""
+        starts, ids = [0], [0]
+        for char, cls in sorted(classes.items()):
+            code = ord(char)
+            if starts[-1] == code:
+                ids[-1] = cls
+            else:
+                starts.append(code)
+                ids.append(cls)
+            starts.append(code + 1)
+            ids.append(0)
+        return ClassMap(starts, ids)
+
+    def class_of_code(self, code) -> int:
+        return self.ids[bisect_right(self.starts, code) - 1]
+
+    def __getitem__(self, char) -> int:
+        return self.class_of_code(ord(char))
+
+    def remap(self, remap) -> 'ClassMap':
+        """Return the map with class c renamed remap[c] (adjacent intervals merged)."""
+        starts, ids = [], []
+        for start, cls in zip(self.starts, self.ids):
+            if not ids or ids[-1] != remap[cls]:
+                starts.append(start)
+                ids.append(remap[cls])
+        return ClassMap(starts, ids)
+
+    def encode(self, string):
+        """Translate `string` into its sequence of class ids.
+
+        While there are at most 256 classes this is done by str.translate and
+        a latin-1 encode, both in C, and gives a bytes object.
+        """
+        if self.n_classes > 256:
+            return [self.class_of_code(ord(char)) for char in string]
+        if self._translation is None:
+            self._translation = _Translation(self)
+        return string.translate(self._translation).encode("latin-1")
+
+
+class DFATable:
+    """DFA with dense integer states and a flat transition table.
+
+    transitions[state * n_classes + cls] is the next state; `classes` (a
+    ClassMap) gives the column of a character, class 0 being the characters
+    no transition reads.
+    """
+
+    def __init__(self, classes, n_classes, transitions, accepting, start, search=False):
+        self.classes = classes  # ClassMap
+        self.n_classes = n_classes
+        self.transitions = transitions  # array('i')
+        self.accepting = accepting  # bytearray, 1 for accepting states
+        self.start = start
+        self.search_mode = search
+        self._rows = None
+        self._accepting_rows = None
+
+    @property
+    def n_states(self):
+        return len(self.accepting)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the table and its scan views."""
+        size = self.transitions.itemsize * len(self.transitions) + len(self.accepting)
+        if self._rows is not None:
+            size += 8 * len(self._rows) + len(self._accepting_rows)
+        return size
+
+    def to_bytes(self) -> bytes:
+        """Serialize to a compact little-endian binary blob (see from_bytes)."""
+        starts = array('i', self.classes.starts)
+        ids = array('i', self.classes.ids)
+        transitions = array('i', self.transitions)
+        if sys.byteorder == "big":
+            for a in (starts, ids, transitions):
+                a.byteswap()
+        header = TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, self.n_classes, self.n_states,
+                                   self.start, self.search_mode, len(starts))
+        return b"".join([header, starts.tobytes(), ids.tobytes(), transitions.tobytes(), bytes(self.accepting)])
+
+    @staticmethod
+    def from_bytes(data) -> 'DFATable':
+        data = memoryview(data)
+        magic, version, n_classes, n_states, start, search, n_intervals = TABLE_HEADER.unpack_from(data)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            raise ValueError("Not a DFA table (or unsupported version)")
+        pos = TABLE_HEADER.size
+        arrays = []
+        for count in (n_intervals, n_intervals, n_states * n_classes):
+            a = array('i')
+            a.frombytes(data[pos:pos + 4 * count])
+            if sys.byteorder == "big":
+                a.byteswap()
+            arrays.append(a)
+            pos += 4 * count
+        starts, ids, transitions = arrays
+        accepting = bytearray(data[pos:pos + n_states])
+        if len(accepting) != n_states:
+            raise ValueError("Truncated DFA table")
+        return DFATable(ClassMap(starts, ids), n_classes, transitions, accepting, start, bool(search))
+
+    @staticmethod
+    def from_states(dfa_start, dfa_accepts, alphabet, search=False, classes=None) -> 'DFATable':
+        """Number the State graph returned by nfa_to_dfa and flatten it.
+
+        `classes` is the ClassMap of the columns; by default every character
+        of `alphabet` is its own class. When the DFA was built over class
+        representatives only, their classes give the columns.
+        """
+        if classes is None:
+            classes = ClassMap.from_chars({char: i for i, char in enumerate(sorted(alphabet), 1)})
+        n_classes = classes.n_classes
+
+        ids = {}
+        order = []
+        stack = [dfa_start]
+        while stack:
+            state = stack.pop()
+            if state in ids:
+                continue
+            ids[state] = len(order) + 1  # 0 is reserved for DEAD
+            order.append(state)
+            for next_states in state.transitions.values():
+                stack.extend(next_states)
+
+        start = ids[dfa_start]
+        n_states = len(order) + 1
+        transitions = array('i', [DEAD]) * (n_states * n_classes)
+        accepting = bytearray(n_states)
+        for state in order:
+            row = ids[state] * n_classes
+            # outside the alphabet: the search DFA falls back to its start state
+            transitions[row] = start if search else DEAD
+            for char, next_states in state.transitions.items():
+                transitions[row + classes[char]] = ids[next(iter(next_states))]
+            if state in dfa_accepts:
+                accepting[ids[state]] = 1
+        return DFATable(classes, n_classes, transitions, accepting, start, search)
+
+    def merge_classes(self) -> 'DFATable':
+        """Return the table with identical columns merged into one class."""
+        n = self.n_classes
+        trans = self.transitions
+        columns = {}
+        remap = []
+        for cls in range(n):
+            column = tuple(trans[cls::n])
+            # column 0 (characters outside the alphabet) keeps id 0
+            remap.append(columns.setdefault(column, len(columns)))
+        n_merged = len(columns)
+        if n_merged == n:
+            return self
+        transitions = array('i', [DEAD]) * (self.n_states * n_merged)
+        for cls in range(n):
+            transitions[remap[cls]::n_merged] = trans[cls::n]
+        return DFATable(self.classes.remap(remap), n_merged, transitions, bytearray(self.accepting), self.start, self.search_mode)
+
+    def minimize(self) -> 'DFATable':
+        """Return the equivalent minimal DFA (Hopcroft partition refinement)."""
+        n = self.n_classes
+        trans = self.transitions
+        n_states = self.n_states
+
+        # inverse[cls][target] -> states reaching target on cls
+        inverse = [{} for _ in range(n)]
+        for state in range(n_states):
+            row = state * n
+            for cls in range(n):
+                inverse[cls].setdefault(trans[row + cls], []).append(state)
+
+        accepting = {state for state in range(n_states) if self.accepting[state]}
+        rejecting = set(range(n_states)) - accepting
+        blocks = [block for block in (accepting, rejecting) if block]
+        block_of = [0] * n_states
+        for i, block in enumerate(blocks):
+            for state in block:
+                block_of[state] = i
+
+        work = set(range(len(blocks)))
+        while work:
+            splitter = list(blocks[work.pop()])
+            for cls in range(n):
+                inv = inverse[cls]
+                hit = {}
+                for target in splitter:
+                    for state in inv.get(target, ()):
+                        hit.setdefault(block_of[state], set()).add(state)
+                for b, part in hit.items():
+                    if len(part) == len(blocks[b]):
+                        continue
+                    blocks[b] -= part
+                    new = len(blocks)
+                    blocks.append(part)
+                    for state in part:
+                        block_of[state] = new
+                    if b in work or len(part) <= len(blocks[b]):
+                        work.add(new)
+                    else:
+                        work.add(b)
+
+        # renumber blocks so the block holding DEAD stays 0
+        new_id = {block_of[DEAD]: DEAD}
+        for b in range(len(blocks)):
+            if b not in new_id:
+                new_id[b] = len(new_id)
+        n_min = len(blocks)
+        transitions = array('i', [DEAD]) * (n_min * n)
+        accepting = bytearray(n_min)
+        for b, block in enumerate(blocks):
+            rep = next(iter(block))
+            row = new_id[b] * n
+            for cls in range(n):
+                transitions[row + cls] = new_id[block_of[trans[rep * n + cls]]]
+            accepting[new_id[b]] = self.accepting[rep]
+        start = new_id[block_of[self.start]]
+        return DFATable(self.classes, n, transitions, accepting, start, self.search_mode)
+
+    def encode(self, string):
+        """Translate `string` into its sequence of class ids (see ClassMap.encode)."""
+        return self.classes.encode(string)
+
+    def step(self, state, cls) -> int:
+        """State reached from `state` on class `cls` (DEAD stays DEAD)."""
+        return self.transitions[state * self.n_classes + cls]
+
+    def accepts(self, state) -> bool:
+        return self.accepting[state] == 1
+
+    def _scan_tables(self):
+        # rows hold next_state * n_classes so the scan loop skips the multiply;
+        # a plain list indexes faster than the array it is built from
+        if self._rows is None:
+            n = self.n_classes
+            self._rows = [state * n for state in self.transitions]
+            accepting_rows = bytearray(len(self._rows))
+            for state, accept in enumerate(self.accepting):
+                accepting_rows[state * n] = accept
+            self._accepting_rows = accepting_rows
+        return self._rows, self._accepting_rows
+
+    def match(self, string) -> bool:
+        """Return True if the whole string is accepted."""
+        rows, acc = self._scan_tables()
+        s = self.start * self.n_classes
+        for cls in self.encode(string):
+            s = rows[s + cls]
+            if s == DEAD:
+                return False
+        return acc[s] == 1
+
+    def search(self, string) -> bool:
+        """Return True if some substring is accepted (table built with search=True)."""
+        rows, acc = self._scan_tables()
+        s = self.start * self.n_classes
+        if acc[s]:
+            return True
+        for cls in self.encode(string):
+            s = rows[s + cls]
+            if acc[s]:
+                return True
+        return False
+
+    def longest_match(self, codes, start) -> int:
+        """End of the longest match anchored at `start` in encoded `codes`, or -1."""
+        rows, acc = self._scan_tables()
+        s = self.start * self.n_classes
+        end = start if acc[s] else -1
+        for pos in range(start, len(codes)):
+            s = rows[s + codes[pos]]
+            if s == DEAD:
+                break
+            if acc[s]:
+                end = pos + 1
+        return end
+
+    def accepts_backward(self, codes) -> bytearray:
+        """Scan `codes` from the end; marks[i] is 1 if the table accepts at i.
+
+        Run on the search table of the reversed regex this marks every
+        position where a match of the original regex starts.
+        """
+        rows, acc = self._scan_tables()
+        s = self.start * self.n_classes
+        marks = bytearray(len(codes) + 1)
+        marks[0] = acc[s]
+        for i, cls in enumerate(codes[::-1], 1):
+            s = rows[s + cls]
+            marks[i] = acc[s]
+        marks.reverse()
+        return marks
+
+
+class LazyDFA:
+    """DFA whose subset states are built only when the scan first reaches them.
+
+    Transitions are memoized in a table of at most `max_states` states. When
+    the budget is exceeded the cache is flushed; after `max_flushes` flushes
+    the pattern is considered too explosive and the scan falls back to plain
+    NFA simulation (like nfa_match).
+    """
+
+    UNKNOWN = -1
+
+    def __init__(self, nfa: NFA, search=False, max_states=10000, max_flushes=8):
+        self.nfa = nfa.compiled
+        self.search_mode = search
+        self.max_states = max_states
+        self.max_flushes = max_flushes
+        starts, ids, chars = NFA.get_classes(nfa)
+        self.classes = ClassMap(starts, ids)
+        self.n_classes = len(chars)
+        self.reads = [self.nfa.reads(char) for char in chars]  # class id -> NFA states reading it
+        self.start_set = self.nfa.start
+        self.start_steps = [self.nfa.step(self.start_set, reads) | self.start_set for reads in self.reads]
+        self.flushes = 0
+        self.fallback = False
+        self._flush()
+
+    @property
+    def n_states(self):
+        return len(self.sets)
+
+    @property
+    def nbytes(self):
+        # rows only; the NFA state sets are shared with the NFA
+        return 8 * len(self.rows) + len(self.accepting)
+
+    def _flush(self):
+        self.sets = [0]  # state id -> bitset of NFA states
+        self.ids = {0: DEAD}
+        self.rows = [DEAD] * self.n_classes
+        self.accepting = bytearray(1)
+        self.start = DEAD
+        self.start = self._add(self.start_set)
+        if self.search_mode:
+            self.rows[self.start * self.n_classes] = self.start
+
+    def _add(self, nfa_set) -> int:
+        state = len(self.sets)
+        self.sets.append(nfa_set)
+        self.ids[nfa_set] = state
+        row = [self.UNKNOWN] * self.n_classes
+        row[0] = self.start if self.search_mode else DEAD
+        self.rows.extend(row)
+        self.accepting.append(nfa_set & ACCEPT)
+        return state
+
+    def _next_set(self, nfa_set, cls):
+        if self.search_mode:
+            # the start set is in every subset: its step is computed once
+            return self.nfa.step(nfa_set & ~self.start_set, self.reads[cls]) | self.start_steps[cls]
+        return self.nfa.step(nfa_set, self.reads[cls])
+
+    def _step(self, state, cls) -> int:
+        """Build (and memoize if possible) the transition of `state` on `cls`."""
+        next_set = self._next_set(self.sets[state], cls)
+        target = self.ids.get(next_set)
+        if target is None:
+            if len(self.sets) >= self.max_states:
+                self.flushes += 1
+                if self.flushes > self.max_flushes:
+                    self.fallback = True
+                self._flush()
+                target = self.ids.get(next_set)
+                return self._add(next_set) if target is None else target
+            target = self._add(next_set)
+        self.rows[state * self.n_classes + cls] = target
+        return target
+
+    def _simulate(self, nfa_set, codes, search):
+        if search and nfa_set & ACCEPT:
+            return True
+        for cls in codes:
+            nfa_set = self._next_set(nfa_set, cls)
+            if search and nfa_set & ACCEPT:
+                return True
+        return bool(nfa_set & ACCEPT)
+
+    def _run(self, string, search) -> bool:
+        codes = self.classes.encode(string)
+        if self.fallback:
+            return self._simulate(self.start_set, codes, search)
+        n = self.n_classes
+        s = self.start
+        if search and self.accepting[s]:
+            return True
+        for pos, cls in enumerate(codes):
+            nxt = self.rows[s * n + cls]
+            if nxt == self.UNKNOWN:
+                nxt = self._step(s, cls)
+                if self.fallback:
+                    return self._simulate(self.sets[nxt], codes[pos + 1:], search)
+            s = nxt
+            if search and self.accepting[s]:
+                return True
+            if s == DEAD and not self.search_mode:
+                return False
+        return self.accepting[s] == 1
+
+    def match(self, string) -> bool:
+        """Return True if the whole string is accepted."""
+        return self._run(string, False)
+
+    def search(self, string) -> bool:
+        """Return True if some substring is accepted (built with search=True)."""
+        return self._run(string, True)
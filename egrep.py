@@ -0,0 +1,175 @@
+import argparse
+import sys
+
+from cache import PatternCache
+from multi import compile_many
+from parallel import parallel_grep
+
+CHUNK_SIZE = 1 << 20  # characters read per call on the underlying file
+
+
+def iter_blocks(stream, chunk_size=CHUNK_SIZE):
+    """Yield (text, lines) for each chunk of `stream`, cut at line boundaries."""
+    tail = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        text, sep, tail = (tail + chunk).rpartition("\n")
+        if sep:
+            yield text, text.split("\n")
+    if tail:
+        yield tail, [tail]
+
+
+def iter_lines(stream, chunk_size=CHUNK_SIZE):
+    """Yield the lines of `stream` (without '\\n') reading it chunk by chunk."""
+    for _, lines in iter_blocks(stream, chunk_size):
+        yield from lines
+
+
+def grep_stream(pattern, stream, chunk_size=CHUNK_SIZE):
+    """Yield (line_number, line) for every line containing a match.
+
+    A whole chunk failing pattern.may_match (required literals missing) is
+    skipped without looking at its lines.
+    """
+    contains = pattern.contains
+    number = 0
+    for text, lines in iter_blocks(stream, chunk_size):
+        if not pattern.may_match(text):
+            number += len(lines)
+            continue
+        for line in lines:
+            number += 1
+            if contains(line):
+                yield number, line
+
+
+def open_input(path):
+    if path == "-":
+        return sys.stdin
+    return open(path, "r", encoding="utf-8", errors="replace", newline="")
+
+
+def grep_files(pattern, paths, chunk_size=CHUNK_SIZE):
+    """Sequential counterpart of parallel.parallel_grep: yield (path, matches)."""
+    for path in paths:
+        try:
+            stream = open_input(path)
+        except OSError as e:
+            yield path, e
+            continue
+        try:
+            yield path, grep_stream(pattern, stream, chunk_size)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print lines matching a regex (egrep-like).")
+    parser.add_argument("regex", nargs="?", help="the regex (omitted with -f)")
+    parser.add_argument("files", nargs="*", help="files to search ('-' for stdin, the default)")
+    parser.add_argument("-f", "--file", help="read the patterns from FILE, one per line; print lines matching any")
+    parser.add_argument("--which", action="store_true", help="with -f, prefix each line with the numbers of its patterns")
+    parser.add_argument("-n", "--line-number", action="store_true", help="prefix each line with its line number")
+    parser.add_argument("-o", "--only-matching", action="store_true", help="print only the matched parts of each line")
+    parser.add_argument("-c", "--count", action="store_true", help="only print the number of matching lines")
+    parser.add_argument("--minimize", action="store_true", help="minimize the DFA before scanning")
+    parser.add_argument("--lazy", action="store_true", help="build DFA states on demand while scanning")
+    parser.add_argument("--max-states", type=int, default=10000,
+                        help="state budget of the DFAs (larger ones use position automata) and of the lazy DFA cache")
+    parser.add_argument("--glushkov", action="store_true", help="always scan with bit-parallel position automata")
+    parser.add_argument("--cache-dir", help="directory of compiled patterns reused across runs")
+    parser.add_argument("--stats", action="store_true", help="print the engine and DFA state counts on stderr")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="worker processes (files only, not stdin)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="characters read per chunk")
+    args = parser.parse_args(argv)
+    files = args.files
+    if args.file is not None:
+        if args.regex is not None:
+            files = [args.regex] + files  # no regex argument with -f: it was a file
+        if args.only_matching:
+            parser.error("-o cannot be used with -f")
+    elif args.regex is None:
+        parser.error("a regex or -f FILE is required")
+    files = files or ["-"]
+    parallel = args.jobs > 1 and "-" not in files
+    if parallel and args.lazy and args.stats:
+        parser.error("--stats cannot be used with --lazy and -j: each worker builds its own lazy DFA")
+
+    try:
+        stats = {}
+        if args.file is not None:
+            with open(args.file, encoding="utf-8") as f:
+                regexes = [line.rstrip("\r\n") for line in f if line.rstrip("\r\n")]
+            pattern = compile_many(regexes, args.max_states, stats)
+        else:
+            cache = PatternCache(directory=args.cache_dir)
+            pattern = cache.compile(args.regex, args.minimize, args.lazy, args.max_states, stats, args.glushkov)
+    except OSError as e:
+        print(f"{args.file}: {e.strerror}", file=sys.stderr)
+        return 2
+    except Exception as e:
+        print("Error parsing regex:", e, file=sys.stderr)
+        return 2
+    if args.stats:
+        print(f"engine: {stats['engine']}", file=sys.stderr)
+    if args.stats and "nodes" in stats:
+        print(f"AST nodes: {stats['nodes']} -> {stats['optimized_nodes']} after optimization", file=sys.stderr)
+    if args.stats and stats["engine"] == "multi":
+        print(f"{len(pattern.regexes)} patterns: {stats['literal_patterns']} literal, "
+              f"{stats['automata']} automata with {stats['dfa_states']} DFA states, "
+              f"{stats['single_patterns']} scanned alone", file=sys.stderr)
+    elif args.stats and "dfa_states" in stats:
+        report = f"DFA states: {stats['dfa_states']}"
+        if "minimized_states" in stats:
+            report += f" -> {stats['minimized_states']} after minimization"
+        report += f", {stats['classes']} character classes"
+        print(report, file=sys.stderr)
+    if args.stats and "positions" in stats:
+        print(f"position automaton: {stats['positions']} positions", file=sys.stderr)
+
+    if parallel:
+        results = parallel_grep(pattern, files, args.jobs)
+    else:
+        results = grep_files(pattern, files, args.chunk_size)
+
+    show_name = len(files) > 1
+    found = False
+    for path, matches in results:
+        if isinstance(matches, OSError):
+            print(f"{path}: {matches.strerror}", file=sys.stderr)
+            continue
+        count = 0
+        for number, line in matches:
+            count += 1
+            if args.count:
+                continue
+            prefix = f"{path}:" if show_name else ""
+            if args.line_number:
+                prefix += f"{number}:"
+            if args.which and args.file is not None:
+                prefix += ",".join(str(i + 1) for i in pattern.matches(line)) + ":"
+            line = line.rstrip("\r")
+            if not args.only_matching:
+                sys.stdout.write(prefix + line + "\n")
+                continue
+            for start, end in pattern.finditer(line):
+                if end > start:
+                    sys.stdout.write(prefix + line[start:end] + "\n")
+        if args.count:
+            print(f"{path}:{count}" if show_name else count)
+        found = found or count > 0
+    if args.stats and stats["engine"] == "lazy-dfa" and not parallel:  # else built by the workers
+        dfa = pattern.contains_dfa
+        report = f"lazy DFA: {dfa.n_states} cached states, {dfa.flushes} flushes"
+        if dfa.fallback:
+            report += ", fell back to NFA simulation"
+        print(report, file=sys.stderr)
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,5 @@
-from astTree import RegExTree, Operation, RegEx
-from nfa import State, NFA, epsilon_closure, nfa_match
+from astTree import RegEx
+from search import build_dfa
 
 
 # # Regex: "a"
@@ -51,12 +51,8 @@ if __name__ == "__main__":
         tree = parser.parse()
         print("Parsed tree:", tree)
 
-        # Build NFA
-        nfa = NFA.tree_to_nfa(tree)
-
-        # Build DFA from NFA
-        alphabet = NFA.get_alphabet(nfa)
-        dfa_start, dfa_accepts = nfa.nfa_to_dfa(alphabet)
+        # Build NFA -> DFA (one column per character class, so `.` and [...] work)
+        dfa = build_dfa(tree)
 
         while True:
             test_str = input("('exit' to quit, 'regex' to ask for another regex)\n Enter a string to test: ")
@@ -68,15 +64,13 @@ if __name__ == "__main__":
                 try:
                     tree = parser.parse()
                     print("Parsed tree:", tree)
-                    nfa = NFA.tree_to_nfa(tree)
-                    alphabet = NFA.get_alphabet(nfa)
-                    dfa_start, dfa_accepts = nfa.nfa_to_dfa(alphabet)
+                    dfa = build_dfa(tree)
                 except Exception as e:
                     print("Error parsing regex:", e)
                 continue
 
             # Test with DFA
-            if NFA.dfa_match(dfa_start, dfa_accepts, test_str):
+            if dfa.match(test_str):
                 print(f"The string '{test_str}' is ACCEPTED by the regex '{regex_str}'")
             else:
                 print(f"The string '{test_str}' is NOT accepted by the regex '{regex_str}'")
@@ -0,0 +1,213 @@
+from bisect import bisect_left
+
+from astTree import RegExTree, Operation, CharClass, ANY_BUT_NEWLINE, MAX_CODE
+from dfa import ClassMap
+from nfa import bits, follow_tables, follow_union
+
+MAX_POSITIONS = 64  # compile() only picks this engine while a state fits in a word
+
+
+def _label_ranges(label):
+    if isinstance(label, str):
+        return [(ord(label), ord(label))]
+    return label.ranges
+
+
+def _position_classes(labels):
+    """ClassMap of the characters no position tells apart, and each class's mask.
+
+    masks[cls] has bit p set if the label of position p contains the
+    characters of class cls; class 0 is the characters no position reads.
+    """
+    bounds = {0}
+    for label in labels[1:]:
+        for lo, hi in _label_ranges(label):
+            bounds.add(lo)
+            bounds.add(hi + 1)
+    bounds = sorted(b for b in bounds if b <= MAX_CODE)
+    interval_masks = [0] * len(bounds)
+    for p, label in enumerate(labels[1:], 1):
+        for lo, hi in _label_ranges(label):
+            i = bisect_left(bounds, lo)
+            while i < len(bounds) and bounds[i] <= hi:
+                interval_masks[i] |= 1 << p
+                i += 1
+
+    class_ids = {0: 0}
+    masks = [0]
+    starts, ids = [], []
+    for bound, mask in zip(bounds, interval_masks):
+        if mask not in class_ids:
+            class_ids[mask] = len(masks)
+            masks.append(mask)
+        if not ids or ids[-1] != class_ids[mask]:
+            starts.append(bound)
+            ids.append(class_ids[mask])
+    return ClassMap(starts, ids), masks
+
+
+def count_positions(tree: RegExTree) -> int:
+    """Number of character positions (leaves) of `tree`: the states of its
+    position automaton, and about as many as its DFA has at least when the
+    regex is mostly a big alternation."""
+    count = 0
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        if t.subTrees:
+            stack.extend(t.subTrees)
+        elif isinstance(t.root, (str, CharClass)) or t.root == Operation.DOT:
+            count += 1
+    return count
+
+
+class PositionAutomaton:
+    """Glushkov automaton of a regex, simulated bit-parallel.
+
+    There is one state per character position of the regex (position 0 is
+    the initial state, 1..m the leaves from left to right) and no epsilon
+    transition, so a set of active states is a plain int and reading a
+    character is
+        D = follow(D) & masks[class of the character]
+    where follow() ORs precomputed per-byte tables (see nfa.follow_tables).
+    Building it is linear in the regex (no subset construction) and scanning
+    is linear in the text.
+
+    Answers the same calls as DFATable (match, search, encode, longest_match,
+    accepts_backward) and can stand in for any of a Pattern's tables.
+    """
+
+    def __init__(self, tree: RegExTree, search=False):
+        self.search_mode = search
+        labels = [None]
+        follow = [0]
+        results = []  # (nullable, first, last) of finished subtrees
+        stack = [(tree, False)]
+        while stack:
+            t, done = stack.pop()
+            if not done and t.subTrees:
+                stack.append((t, True))
+                stack.extend((sub, False) for sub in reversed(t.subTrees))
+                continue
+            if isinstance(t.root, (str, CharClass)) or t.root == Operation.DOT:
+                position = 1 << len(labels)
+                labels.append(ANY_BUT_NEWLINE if t.root == Operation.DOT else t.root)
+                follow.append(0)
+                results.append((False, position, position))
+            elif t.root in (Operation.CONCAT, Operation.ALTERN):
+                parts = results[len(results) - len(t.subTrees):]
+                del results[len(results) - len(t.subTrees):]
+                l_nullable, l_first, l_last = parts[0]
+                for r_nullable, r_first, r_last in parts[1:]:
+                    if t.root == Operation.ALTERN:
+                        l_nullable, l_first, l_last = l_nullable or r_nullable, l_first | r_first, l_last | r_last
+                        continue
+                    for p in bits(l_last):
+                        follow[p] |= r_first
+                    l_nullable, l_first, l_last = (l_nullable and r_nullable,
+                                                   l_first | r_first if l_nullable else l_first,
+                                                   l_last | r_last if r_nullable else r_last)
+                results.append((l_nullable, l_first, l_last))
+            elif t.root in (Operation.ETOILE, Operation.PLUS):
+                nullable, first, last = results.pop()
+                for p in bits(last):
+                    follow[p] |= first
+                results.append((nullable or t.root == Operation.ETOILE, first, last))
+            else:
+                raise ValueError(f"Unsupported tree node: {t.root}")
+
+        nullable, first, last = results[0]
+        follow[0] = first
+        self.n_positions = len(labels) - 1
+        self.accept = last | 1 if nullable else last
+        self.classes, self.masks = _position_classes(labels)
+        self.follow = follow
+        self.tables = follow_tables(follow)
+
+    @property
+    def n_states(self):
+        return self.n_positions + 1
+
+    @property
+    def nbytes(self):
+        # one machine word per follow set, table entry and mask
+        entries = sum(len(table) for table in self.tables) if self.tables is not None else 0
+        return 8 * (len(self.follow) + entries + len(self.masks))
+
+    def encode(self, string):
+        """Translate `string` into its sequence of class ids (see ClassMap.encode)."""
+        return self.classes.encode(string)
+
+    start = 1  # the initial position alone; 0 is the dead (empty) set
+
+    def step(self, state, cls) -> int:
+        """Anchored step: positions active after reading class `cls` from `state`."""
+        mask = self.masks[cls]
+        return self._follow(state) & mask if mask else 0
+
+    def accepts(self, state) -> bool:
+        return bool(state & self.accept)
+
+    def _follow(self, state) -> int:
+        return follow_union(self.follow, self.tables, state)
+
+    def _scan(self, codes, state, search, stop_dead):
+        """Run from `state`; return the final state, or -1 as soon as one accepts
+        (search) / the set dies (stop_dead)."""
+        masks, accept, tables = self.masks, self.accept, self.tables
+        if tables is not None and len(tables) == 1:
+            table = tables[0]
+            for cls in codes:
+                state = table[state | search] & masks[cls]
+                if state & accept and search:
+                    return -1
+                if not state and stop_dead:
+                    return 0
+            return state
+        follow = self._follow
+        for cls in codes:
+            mask = masks[cls]
+            state = follow(state | search) & mask if mask else 0
+            if state & accept and search:
+                return -1
+            if not state and stop_dead:
+                return 0
+        return state
+
+    def match(self, string) -> bool:
+        if self.search_mode:
+            return self.search(string)
+        return bool(self._scan(self.encode(string), 1, 0, True) & self.accept)
+
+    def search(self, string) -> bool:
+        """Return True if some substring of `string` matches."""
+        if self.accept & 1:
+            return True
+        return self._scan(self.encode(string), 0, 1, False) == -1
+
+    def longest_match(self, codes, start) -> int:
+        """End of the longest match anchored at `start` in encoded `codes`, or -1."""
+        masks, accept, follow = self.masks, self.accept, self._follow
+        state = 1
+        end = start if accept & 1 else -1
+        for pos in range(start, len(codes)):
+            state = follow(state) & masks[codes[pos]]
+            if not state:
+                break
+            if state & accept:
+                end = pos + 1
+        return end
+
+    def accepts_backward(self, codes) -> bytearray:
+        """Scan `codes` from the end in search mode; marks[i] is 1 if a match
+        of this automaton ends at i (see DFATable.accepts_backward)."""
+        masks, accept, follow = self.masks, self.accept, self._follow
+        state = 0
+        marks = bytearray(len(codes) + 1)
+        marks[0] = accept & 1
+        for i, cls in enumerate(codes[::-1], 1):
+            mask = masks[cls]
+            state = follow(state | 1) & mask if mask else 0
+            marks[i] = 1 if (state & accept or accept & 1) else 0
+        marks.reverse()
+        return marks
@@ -0,0 +1,241 @@
+import argparse
+import os
+import sys
+from array import array
+from typing import Dict, Iterator, List, Tuple
+
+import search
+from astTree import RegEx
+from egrep import iter_blocks, open_input
+from indexfile import IndexFile, write_index
+from literal import literal_strings
+from optimize import optimize
+from prefilter import literal_info
+from termdict import TermDictionary
+
+RANK_SUFFIX = ".rank"  # scores file saved next to an index (see similarity.py)
+
+
+class _WordChars(dict):
+    """str.translate table turning every non-alphanumeric character into a space."""
+
+    def __missing__(self, code):
+        value = self[code] = code if chr(code).isalnum() else 32
+        return value
+
+
+_WORD_CHARS = _WordChars()
+
+
+def tokenize(text: str) -> List[str]:
+    """Words of `text`: maximal runs of alphanumeric characters, case kept."""
+    return text.translate(_WORD_CHARS).split()
+
+
+def iter_words(stream) -> Iterator[str]:
+    """Yield the words of `stream`, read block by block (words never span lines)."""
+    for text, _ in iter_blocks(stream):
+        yield from tokenize(text)
+
+
+def list_files(directory: str) -> List[str]:
+    """Regular files under `directory`, in a stable (sorted) order."""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files))
+    return paths
+
+
+class TermQuery:
+    """A regex compiled once for matching whole terms, in any number of indexes.
+
+    Plain literals are looked up; otherwise the anchored automaton (alone:
+    no search DFA is built) walks only the ranges of terms starting with
+    the regex's literal prefixes.
+    """
+
+    def __init__(self, regex_str: str):
+        self.regex = regex_str
+        tree = RegEx(regex_str).parse()
+        self.literals = literal_strings(tree)
+        if self.literals is None:
+            self.automaton = search.build_table(optimize(tree), search=False)
+            self.prefixes = literal_info(tree).prefix
+
+
+class InvertedIndex:
+    """Term dictionary of a corpus with, for each term, its posting list.
+
+    postings[term] lists (doc id, positions) by increasing doc id, the
+    positions being the word numbers of the term's occurrences in that
+    document. A regex query is matched against the vocabulary only, never
+    the texts: its automaton walks the TermDictionary, skipping every term
+    under a prefix that leads to the dead state.
+
+    When `scores` (one float per document, see similarity.py) is set,
+    query results come best score first.
+    """
+
+    def __init__(self):
+        self.documents = []  # doc id -> path
+        self.postings: Dict[str, List[Tuple[int, List[int]]]] = {}
+        self.scores = None
+        self._dictionary = None
+
+    def add_document(self, name: str, words) -> int:
+        """Index the sequence `words` as a new document; return its id."""
+        if isinstance(self.postings, IndexFile):
+            raise ValueError("an index loaded from a file is read-only")
+        doc_id = len(self.documents)
+        self.documents.append(name)
+        positions = {}
+        for position, word in enumerate(words):
+            positions.setdefault(word, []).append(position)
+        postings = self.postings
+        self._dictionary = None
+        for term, term_positions in positions.items():
+            postings.setdefault(term, []).append((doc_id, term_positions))
+        return doc_id
+
+    def add_file(self, path: str) -> int:
+        with open_input(path) as stream:
+            return self.add_document(path, iter_words(stream))
+
+    @classmethod
+    def from_directory(cls, directory: str) -> 'InvertedIndex':
+        index = cls()
+        for path in list_files(directory):
+            index.add_file(path)
+        return index
+
+    @property
+    def dictionary(self) -> TermDictionary:
+        if self._dictionary is None:
+            if isinstance(self.postings, IndexFile):
+                self._dictionary = TermDictionary(self.postings.terms, self.postings.lcp)
+            else:
+                self._dictionary = TermDictionary(self.postings)
+        return self._dictionary
+
+    def vocabulary(self) -> List[str]:
+        return self.dictionary.terms
+
+    def terms(self, query) -> List[str]:
+        """Terms of the vocabulary matched whole by `query` (a regex or TermQuery), sorted."""
+        if not isinstance(query, TermQuery):
+            query = TermQuery(query)
+        if query.literals is not None:
+            return sorted(literal for literal in query.literals if literal in self.postings)
+        return self.dictionary.expand(query.automaton, query.prefixes)
+
+    def query(self, query) -> List[int]:
+        """Ids of the documents containing a word matched by `query` (a regex or TermQuery).
+
+        They are sorted by decreasing score if the index has scores, else by id.
+        """
+        doc_ids = set()
+        for term in self.terms(query):
+            doc_ids.update(self.doc_ids(term))
+        if self.scores is not None:
+            scores = self.scores
+            return sorted(doc_ids, key=lambda doc_id: (-scores[doc_id], doc_id))
+        return sorted(doc_ids)
+
+    def doc_ids(self, term: str) -> List[int]:
+        """Ids of the documents containing `term` (positions are not decoded)."""
+        if isinstance(self.postings, IndexFile):
+            return self.postings.doc_ids(term)
+        return [doc_id for doc_id, _ in self.postings.get(term, ())]
+
+    def iter_doc_ids(self) -> Iterator[Tuple[str, List[int]]]:
+        """(term, doc ids) for every term, in one sequential pass."""
+        if isinstance(self.postings, IndexFile):
+            for i, term in enumerate(self.postings.terms):
+                yield term, self.postings.doc_ids_at(i)
+        else:
+            for term, entries in self.postings.items():
+                yield term, [doc_id for doc_id, _ in entries]
+
+    def save(self, path: str):
+        write_index(path, self.documents, self.postings)
+        if self.scores is not None:
+            save_scores(path, self.scores)
+        elif os.path.exists(path + RANK_SUFFIX):
+            os.remove(path + RANK_SUFFIX)  # scores of the index this one replaces
+
+    @classmethod
+    def load(cls, path: str) -> 'InvertedIndex':
+        """Open a saved index read-only; its tables stay in the mapped file (see IndexFile).
+
+        The scores saved next to it, if any, are loaded too.
+        """
+        index = cls()
+        index.postings = IndexFile(path)
+        index.documents = index.postings.documents
+        if os.path.exists(path + RANK_SUFFIX):
+            index.scores = load_scores(path, len(index.documents))
+        return index
+
+    def close(self):
+        """Unmap the file of a loaded index; an in-memory one has nothing to release."""
+        if isinstance(self.postings, IndexFile):
+            self.postings.close()
+
+
+def save_scores(path: str, scores):
+    """Write the document scores of the index at `path` next to it."""
+    with open(path + RANK_SUFFIX, "wb") as f:
+        array('d', scores).tofile(f)
+
+
+def load_scores(path: str, n_documents: int) -> array:
+    scores = array('d')
+    with open(path + RANK_SUFFIX, "rb") as f:
+        data = f.read()
+    if len(data) != n_documents * scores.itemsize:
+        raise ValueError(f"{path + RANK_SUFFIX}: scores do not match the index")
+    scores.frombytes(data)
+    return scores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query an inverted word index of a corpus.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index every file under a directory")
+    build.add_argument("directory")
+    build.add_argument("-o", "--output", required=True, help="index file to write")
+    query = commands.add_parser("query", help="print the documents containing a word matched by a regex")
+    query.add_argument("index", help="index file written by 'build'")
+    query.add_argument("regex")
+    query.add_argument("--terms", action="store_true", help="print the matched terms instead of the documents")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "build":
+            index = InvertedIndex.from_directory(args.directory)
+            index.save(args.output)
+            print(f"{len(index.documents)} documents, {len(index.postings)} terms", file=sys.stderr)
+            return 0
+        index = InvertedIndex.load(args.index)
+    except OSError as e:
+        print(f"{e.filename}: {e.strerror}", file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    try:
+        if args.terms:
+            results = index.terms(args.regex)
+        else:
+            results = [index.documents[doc_id] for doc_id in index.query(args.regex)]
+    except Exception as e:
+        print("Error parsing regex:", e, file=sys.stderr)
+        return 2
+    for result in results:
+        print(result)
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from typing import Iterable, Iterator, List, Tuple
+
+from termdict import TermDictionary
+
+MAGIC = b"RXIX"
+VERSION = 1
+HAS_POSITIONS = 1  # flag: postings carry word positions
+# magic, version, flags, number of documents, number of terms
+HEADER = struct.Struct("<4sHHQQ")
+SECTIONS = ("doc_offsets", "doc_names", "term_offsets", "term_bytes", "lcp",
+            "posting_offsets", "doc_stream", "position_stream")
+SECTION_TABLE = struct.Struct("<" + "Q" * (len(SECTIONS) + 1))  # start of each section, then the end
+
+
+def encode_varint(value: int, out: bytearray):
+    """Append `value` (>= 0) to `out` in LEB128: 7 bits per byte, high bit = more."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(data) -> Iterator[int]:
+    """Yield the LEB128 integers of `data` (bytes or memoryview)."""
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield value
+        value = shift = 0
+
+
+def encode_deltas(values: Iterable[int], out: bytearray):
+    """Append increasing `values` as varints of their differences."""
+    previous = 0
+    for value in values:
+        encode_varint(value - previous, out)
+        previous = value
+
+
+def decode_deltas(data) -> List[int]:
+    values = []
+    current = 0
+    for delta in decode_varints(data):
+        current += delta
+        values.append(current)
+    return values
+
+
+def _string_table(strings: Iterable[str]) -> Tuple[array, bytearray]:
+    offsets = array('Q', [0])
+    data = bytearray()
+    for string in strings:
+        data += string.encode("utf-8")
+        offsets.append(len(data))
+    return offsets, data
+
+
+def _pad(out: bytearray):
+    out += bytes(-len(out) % 8)  # sections start on 8-byte boundaries
+
+
+def write_index(path: str, documents: List[str], postings, positions=True):
+    """Write an index file (see IndexFile).
+
+    `postings` maps each term to its postings by increasing doc id: a list
+    of (doc id, positions) when `positions` is true, else of doc ids.
+    """
+    dictionary = TermDictionary(postings)
+    terms, lcp = dictionary.terms, dictionary.lcp
+    posting_offsets = array('Q', [0, 0])  # (doc stream, position stream) start of each term, then the ends
+    doc_stream = bytearray()
+    position_stream = bytearray()
+    for term in terms:
+        entries = postings[term]
+        if positions:
+            encode_deltas((doc_id for doc_id, _ in entries), doc_stream)
+            for _, doc_positions in entries:
+                encode_varint(len(doc_positions), position_stream)
+                encode_deltas(doc_positions, position_stream)
+        else:
+            encode_deltas(entries, doc_stream)
+        posting_offsets.append(len(doc_stream))
+        posting_offsets.append(len(position_stream))
+
+    doc_offsets, doc_names = _string_table(documents)
+    term_offsets, term_bytes = _string_table(terms)
+    sections = [doc_offsets.tobytes(), doc_names, term_offsets.tobytes(), term_bytes, lcp.tobytes(),
+                posting_offsets.tobytes(), doc_stream, position_stream]
+    out = bytearray(HEADER.pack(MAGIC, VERSION, HAS_POSITIONS if positions else 0, len(documents), len(terms)))
+    out += bytes(SECTION_TABLE.size)
+    _pad(out)
+    starts = []
+    for section in sections:
+        starts.append(len(out))
+        out += section
+        _pad(out)
+    starts.append(len(out))
+    SECTION_TABLE.pack_into(out, HEADER.size, *starts)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+class StringTable(Sequence):
+    """Strings stored back to back, read through an offsets table; decoded on access."""
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string table index out of range")
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+
+class IndexFile(Mapping):
+    """Read-only index file, opened with mmap: term -> postings.
+
+    Layout: a header, a table of section offsets, then 8-byte aligned
+    sections: document names and terms (UTF-8, each with an offsets
+    table), the lcp array of the sorted terms (see TermDictionary), a table
+    of each term's start in the two posting streams, the doc ids (varint
+    deltas) and the positions (per document: count, then varint deltas).
+
+    Opening only maps the file and reads the header: every table is a
+    memoryview cast over the mapping, and postings are decoded on access,
+    from zero-copy slices. Values are shaped like the in-memory indexes':
+    a list of (doc id, positions), or of doc ids without positions.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if len(view) < HEADER.size + SECTION_TABLE.size:
+            raise ValueError(f"{path}: not an index file")
+        magic, version, flags, n_docs, n_terms = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not an index file (or unsupported version)")
+        starts = SECTION_TABLE.unpack_from(view, HEADER.size)
+        sections = {name: view[start:end] for name, start, end in zip(SECTIONS, starts, starts[1:])}
+        self._views = [view] + list(sections.values())
+        self.positions = bool(flags & HAS_POSITIONS)
+        self.documents = StringTable(sections["doc_offsets"].cast('Q'), sections["doc_names"])
+        self.terms = StringTable(sections["term_offsets"].cast('Q'), sections["term_bytes"])
+        lcp = sections["lcp"].cast('I')
+        self.lcp = lcp[:n_terms]  # without the padding
+        self._offsets = sections["posting_offsets"].cast('Q')
+        self._doc_stream = sections["doc_stream"]
+        self._position_stream = sections["position_stream"]
+        self._views += [self.documents.offsets, self.terms.offsets, lcp, self.lcp, self._offsets]
+        if len(self.documents) != n_docs or len(self.terms) != n_terms:
+            raise ValueError(f"{path}: corrupted index file")
+
+    def close(self):
+        # every view over the mapping must be released before it can close
+        for view in reversed(self._views):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def find(self, term) -> int:
+        """Index of `term` in the sorted terms, or -1."""
+        i = bisect_left(self.terms, term)
+        return i if i < len(self.terms) and self.terms[i] == term else -1
+
+    def __contains__(self, term):
+        return isinstance(term, str) and self.find(term) >= 0
+
+    def doc_ids_at(self, i) -> List[int]:
+        """Doc ids of the i-th term, decoding the doc stream only."""
+        offsets = self._offsets
+        return decode_deltas(self._doc_stream[offsets[2 * i]:offsets[2 * i + 2]])
+
+    def doc_ids(self, term) -> List[int]:
+        i = self.find(term)
+        return self.doc_ids_at(i) if i >= 0 else []
+
+    def postings_at(self, i):
+        """Postings of the i-th term (see the class docstring for their shape)."""
+        doc_ids = self.doc_ids_at(i)
+        if not self.positions:
+            return doc_ids
+        offsets = self._offsets
+        numbers = decode_varints(self._position_stream[offsets[2 * i + 1]:offsets[2 * i + 3]])
+        entries = []
+        for doc_id in doc_ids:
+            positions = []
+            position = 0
+            for _ in range(next(numbers)):
+                position += next(numbers)
+                positions.append(position)
+            entries.append((doc_id, positions))
+        return entries
+
+    def __getitem__(self, term):
+        i = self.find(term)
+        if i < 0:
+            raise KeyError(term)
+        return self.postings_at(i)
+
+    def items(self):
+        """(term, postings) in term order, read sequentially (no lookups)."""
+        for i, term in enumerate(self.terms):
+            yield term, self.postings_at(i)
@@ -0,0 +1,86 @@
+from typing import Iterator, List, Optional, Tuple
+
+from astTree import RegExTree, Operation
+
+MAX_LITERALS = 16  # larger alternations stay on the automaton path
+
+
+def literal_string(tree: RegExTree) -> Optional[str]:
+    """Return the string spelled by a CONCAT chain of literals, else None."""
+    chars = []
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        if isinstance(t.root, str):
+            chars.append(t.root)
+        elif t.root == Operation.CONCAT:
+            stack.extend(reversed(t.subTrees))
+        else:
+            return None
+    return "".join(chars)
+
+
+def literal_strings(tree: RegExTree, max_literals=MAX_LITERALS) -> Optional[List[str]]:
+    """Return the literals of a pure string or of an alternation of strings."""
+    literals = {}  # a dict keeps the first occurrence order, with O(1) duplicate checks
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        if t.root == Operation.ALTERN:
+            stack.extend(reversed(t.subTrees))
+            continue
+        literal = literal_string(t)
+        if literal is None or len(literals) == max_literals:
+            return None
+        literals[literal] = None
+    return list(literals)
+
+
+class LiteralPattern:
+    """Search engine for regexes that are plain strings (or a few of them).
+
+    Occurrences are located with str.find, CPython's C substring search
+    (a Boyer-Moore-Horspool / Sunday hybrid with skip table), and follow the
+    same leftmost-longest, non-overlapping rules as search.Pattern.
+    """
+
+    def __init__(self, regex_str: str, literals: List[str]):
+        self.regex = regex_str
+        self.literals = literals
+
+    def contains(self, string) -> bool:
+        return any(literal in string for literal in self.literals)
+
+    may_match = contains
+
+    @property
+    def nbytes(self):
+        return sum(len(literal) for literal in self.literals)
+
+    def fullmatch(self, string) -> bool:
+        return string in self.literals
+
+    def finditer(self, string, pos=0) -> Iterator[Tuple[int, int]]:
+        """Yield (start, end) of every non-overlapping match from `pos` on."""
+        literals = self.literals
+        # next known occurrence of each literal, refreshed once passed
+        nexts = [string.find(literal, pos) for literal in literals]
+        while True:
+            best_start, best_end = -1, -1
+            for i, literal in enumerate(literals):
+                start = nexts[i]
+                if 0 <= start < pos:
+                    start = nexts[i] = string.find(literal, pos)
+                if start < 0:
+                    continue
+                end = start + len(literal)
+                if best_start < 0 or start < best_start or (start == best_start and end > best_end):
+                    best_start, best_end = start, end
+            if best_start < 0:
+                return
+            yield best_start, best_end
+            pos = best_end
+
+    def search(self, string, pos=0) -> Optional[Tuple[int, int]]:
+        """Return (start, end) of the leftmost-longest match, or None."""
+        return next(self.finditer(string, pos), None)
@@ -0,0 +1,237 @@
+from array import array
+from collections import deque
+from typing import List, Optional
+
+from astTree import RegEx, RegExTree
+from dfa import DEAD, ClassMap, DFATable
+from literal import literal_strings
+from nfa import NFA, State, CompiledNFA, DFATooLarge, bits
+from optimize import optimize
+from search import Pattern
+
+MAX_SET_LITERALS = 100000  # literal alternations up to this size go to Aho-Corasick
+
+
+class TaggedDFA:
+    """Search DFA whose states carry the set of patterns matched on reaching them.
+
+    tags[state] is a bitset of pattern ids (bit i = pattern i); a pattern
+    matches somewhere in a string if a state tagged with it is reached.
+    """
+
+    def __init__(self, table: DFATable, tags: List[int]):
+        self.table = table
+        self.tags = tags
+        self._tag_rows = None
+
+    @property
+    def n_states(self):
+        return self.table.n_states
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes + 8 * len(self.tags)
+
+    def scan(self, string) -> int:
+        """Bitset of the patterns matching somewhere in `string`."""
+        table = self.table
+        rows, acc = table._scan_tables()
+        if self._tag_rows is None:
+            # tags indexed like `rows`, by state * n_classes
+            self._tag_rows = {state * table.n_classes: tag for state, tag in enumerate(self.tags) if tag}
+        tag_rows = self._tag_rows
+        s = table.start * table.n_classes
+        found = tag_rows.get(s, 0)
+        for cls in table.encode(string):
+            s = rows[s + cls]
+            if acc[s]:
+                found |= tag_rows[s]
+        return found
+
+
+def combined_dfa(trees: List[RegExTree], pattern_ids: List[int], max_states=None) -> TaggedDFA:
+    """Determinize the union of `trees` into one search DFA tagged with `pattern_ids`.
+
+    The patterns share one NFA (a new start state with an epsilon edge to
+    each of them) whose accept states are tagged by CompiledNFA. Raises
+    DFATooLarge past `max_states` states.
+    """
+    nfas = [NFA.tree_to_nfa(tree) for tree in trees]
+    start = State()
+    start.add_epsilon(*(nfa.start_state for nfa in nfas))
+    union = NFA(start, None)  # no shared accept state: every pattern has its tag
+    compiled = CompiledNFA(union, tagged=[nfa.accept_states for nfa in nfas])
+    starts, ids, representatives = NFA.get_classes(union)
+    classes = ClassMap(starts, ids)
+    n_classes = classes.n_classes
+    pattern_of_bit = {bit: pattern_id for bit, pattern_id in zip(compiled.tag_bits, pattern_ids)}
+    all_tags = sum(compiled.tag_bits)
+
+    reads = [compiled.reads(char) for char in representatives]
+    start_set = compiled.start
+    # every subset contains start_set: its step is computed once per class
+    start_steps = [compiled.step(start_set, mask) | start_set for mask in reads]
+    others = ~start_set
+    sets = [0, start_set]  # state id -> NFA state bitset; 0 is DEAD
+    state_ids = {0: DEAD, start_set: 1}
+    transitions = array('i', [DEAD]) * n_classes
+    state = 1
+    while state < len(sets):
+        current = sets[state] & others
+        for cls, mask in enumerate(reads):
+            next_set = compiled.step(current, mask) | start_steps[cls]
+            target = state_ids.get(next_set)
+            if target is None:
+                if max_states is not None and len(sets) > max_states:
+                    raise DFATooLarge(f"DFA has more than {max_states} states")
+                target = state_ids[next_set] = len(sets)
+                sets.append(next_set)
+            transitions.append(target)
+        state += 1
+
+    tags = []
+    for nfa_set in sets:
+        tag = 0
+        for bit in bits(nfa_set & all_tags):
+            tag |= 1 << pattern_of_bit[1 << bit]
+        tags.append(tag)
+    accepting = bytearray(1 if tag else 0 for tag in tags)
+    table = DFATable(classes, n_classes, transitions, accepting, 1, search=True)
+    return TaggedDFA(table.merge_classes(), tags)
+
+
+def aho_corasick(literal_sets: List[List[str]], pattern_ids: List[int]) -> TaggedDFA:
+    """Aho-Corasick automaton of the literals, as a TaggedDFA.
+
+    Pattern pattern_ids[k] matches when one of literal_sets[k] occurs. The
+    trie, its failure links and the full transition table are built in time
+    linear in the total literal length (times the alphabet size), with no
+    subset construction.
+    """
+    goto = [{}]  # trie node -> {char: child}
+    output = [0]
+    for literals, pattern_id in zip(literal_sets, pattern_ids):
+        for literal in literals:
+            node = 0
+            for char in literal:
+                child = goto[node].get(char)
+                if child is None:
+                    child = goto[node][char] = len(goto)
+                    goto.append({})
+                    output.append(0)
+                node = child
+            output[node] |= 1 << pattern_id
+
+    alphabet = sorted({char for children in goto for char in children})
+    classes = ClassMap.from_chars({char: cls for cls, char in enumerate(alphabet, 1)})
+    n_classes = len(alphabet) + 1
+    # trie node i is table state i + 1, state 0 stays DEAD; unknown characters
+    # (class 0) and missing edges of the root lead back to the root
+    root = 1
+    transitions = array('i', [DEAD]) * ((len(goto) + 1) * n_classes)
+    root_row = root * n_classes
+    for cls in range(n_classes):
+        transitions[root_row + cls] = root
+    fail = [0] * len(goto)
+    queue = deque()
+    for char, child in goto[0].items():
+        transitions[root_row + classes[char]] = child + 1
+        queue.append(child)
+    while queue:
+        node = queue.popleft()
+        row = (node + 1) * n_classes
+        fail_row = (fail[node] + 1) * n_classes
+        # missing edges follow the failure link (its row is already complete)
+        transitions[row:row + n_classes] = transitions[fail_row:fail_row + n_classes]
+        for char, child in goto[node].items():
+            fail[child] = transitions[fail_row + classes[char]] - 1
+            output[child] |= output[fail[child]]
+            transitions[row + classes[char]] = child + 1
+            queue.append(child)
+
+    tags = [0] + output
+    accepting = bytearray(1 if tag else 0 for tag in tags)
+    table = DFATable(classes, n_classes, transitions, accepting, root, search=True)
+    return TaggedDFA(table.merge_classes(), tags)
+
+
+class MultiPattern:
+    """Many regexes matched together: one scan of a line tells which match.
+
+    Pure-literal patterns (strings or alternations of strings) share one
+    Aho-Corasick automaton; the others are unioned into combined DFAs whose
+    accepting states carry pattern ids. A combined DFA that would exceed
+    `max_states` states is split in two; a single pattern too large on its
+    own is left to search.Pattern (and scanned on its own).
+    """
+
+    def __init__(self, regexes: List[str], max_states=10000, stats: Optional[dict] = None):
+        self.regexes = list(regexes)
+        self.max_states = max_states
+        trees = [RegEx(regex).parse() for regex in self.regexes]
+        literal_sets, literal_ids, others = [], [], []
+        for pattern_id, tree in enumerate(trees):
+            literals = literal_strings(tree, MAX_SET_LITERALS)
+            if literals is not None:
+                literal_sets.append(literals)
+                literal_ids.append(pattern_id)
+            else:
+                others.append(pattern_id)
+                trees[pattern_id] = optimize(tree)
+
+        self.automata = []
+        if literal_sets:
+            self.automata.append(aho_corasick(literal_sets, literal_ids))
+        self.singles = []  # (pattern id, Pattern)
+        pending = [others] if others else []
+        while pending:
+            group = pending.pop()
+            try:
+                self.automata.append(combined_dfa([trees[i] for i in group], group, max_states))
+            except DFATooLarge:
+                if len(group) == 1:
+                    pattern_id = group[0]
+                    pattern = Pattern(self.regexes[pattern_id], max_states=max_states, tree=trees[pattern_id])
+                    self.singles.append((pattern_id, pattern))
+                else:
+                    pending.append(group[len(group) // 2:])
+                    pending.append(group[:len(group) // 2])
+        if stats is not None:
+            stats["engine"] = "multi"
+            stats["literal_patterns"] = len(literal_ids)
+            stats["automata"] = len(self.automata)
+            stats["dfa_states"] = sum(a.n_states for a in self.automata)
+            stats["single_patterns"] = len(self.singles)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.automata) + sum(p.nbytes for _, p in self.singles)
+
+    def scan(self, string) -> int:
+        """Bitset of the patterns matching somewhere in `string`."""
+        found = 0
+        for automaton in self.automata:
+            found |= automaton.scan(string)
+        for pattern_id, pattern in self.singles:
+            if pattern.contains(string):
+                found |= 1 << pattern_id
+        return found
+
+    def matches(self, string) -> List[int]:
+        """Ids (indexes in `regexes`) of the patterns matching in `string`."""
+        return list(bits(self.scan(string)))
+
+    def may_match(self, text) -> bool:
+        return True
+
+    def contains(self, string) -> bool:
+        """Return True if some pattern matches somewhere in `string`."""
+        for automaton in self.automata:
+            if automaton.table.search(string):
+                return True
+        return any(pattern.contains(string) for _, pattern in self.singles)
+
+
+def compile_many(regexes: List[str], max_states=10000, stats=None) -> MultiPattern:
+    """Compile `regexes` into one MultiPattern (see there)."""
+    return MultiPattern(regexes, max_states, stats)
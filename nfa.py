@@ -1,9 +1,24 @@
-from astTree import RegEx, RegExTree, Operation
+from bisect import bisect_left
+
+from astTree import RegEx, RegExTree, Operation, CharClass, ANY_BUT_NEWLINE, MAX_CODE
+
+
+CHUNK_BITS = 8  # follow sets are united one byte of the state set at a time
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+MAX_TABLE_STATES = 512  # above this, per-byte tables cost more memory than they save
+
+
+class DFATooLarge(Exception):
+    pass
+
 
 class State:
+    __slots__ = ("transitions", "epsilon_transitions", "class_transitions")
+
     def __init__(self):
         self.transitions = {}  # char -> set of states
         self.epsilon_transitions = set()  # set of states
+        self.class_transitions = []  # (CharClass, state): one edge for a whole set of chars
 
     def add_transition(self, char, state):
         if char not in self.transitions:
@@ -13,81 +28,121 @@ class State:
     def add_epsilon(self, *states):
         self.epsilon_transitions.update(states)
 
+    def add_class_transition(self, char_class, state):
+        self.class_transitions.append((char_class, state))
+
 
 class NFA:
     def __init__(self, start_state: State, accept_states: State):
         self.start_state = start_state
         self.accept_states = accept_states
+        self._compiled = None
+
+    @property
+    def compiled(self) -> 'CompiledNFA':
+        """The CompiledNFA of this graph, built on first use (the graph must not change afterwards)."""
+        if self._compiled is None:
+            self._compiled = CompiledNFA(self)
+        return self._compiled
 
 
     @staticmethod
     def tree_to_nfa(tree : RegExTree) -> 'NFA':
-        if tree.root == Operation.CONCAT:
-            left = NFA.tree_to_nfa(tree.subTrees[0])
-            right = NFA.tree_to_nfa(tree.subTrees[1])
-            left.accept_states.add_epsilon(right.start_state)
-            return NFA(left.start_state, right.accept_states)
-        elif tree.root == Operation.ALTERN:
-            left = NFA.tree_to_nfa(tree.subTrees[0])
-            right = NFA.tree_to_nfa(tree.subTrees[1])
-            start = State()
-            accept = State()
-            start.add_epsilon(left.start_state, right.start_state)
-            left.accept_states.add_epsilon(accept)
-            right.accept_states.add_epsilon(accept)
-            return NFA(start, accept)
-
-        elif tree.root == Operation.ETOILE:
-            sub_nfa = NFA.tree_to_nfa(tree.subTrees[0])
-            start = State()
-            accept = State()
-            start.add_epsilon(sub_nfa.start_state, accept)
-            sub_nfa.accept_states.add_epsilon(sub_nfa.start_state, accept)
-            return NFA(start, accept)
-
-        elif tree.root == Operation.PLUS:
-            sub_nfa = NFA.tree_to_nfa(tree.subTrees[0])
-            start = State()
-            accept = State()
-            start.add_epsilon(sub_nfa.start_state)
-            sub_nfa.accept_states.add_epsilon(sub_nfa.start_state, accept)
-            return NFA(start, accept)
-        elif isinstance(tree.root, str):
-            # ← this is critical
-            start = State()
-            accept = State()
-            start.add_transition(tree.root, accept)
-            return NFA(start, accept)
-
-        else:
-            raise ValueError(f"Unsupported tree node: {tree.root}")
-
-    def nfa_to_dfa(self, alphabet):
-        start_set = epsilon_closure({self.start_state})
-        dfa_states = {frozenset(start_set): State()}  # map NFA sets → DFA state
-        unmarked = [frozenset(start_set)]  # DFA states to process
-        dfa_start = dfa_states[frozenset(start_set)]
+        # Thompson construction, bottom-up with an explicit stack: `results`
+        # holds the NFAs of the finished subtrees (no recursion, so left-deep
+        # CONCAT chains of any length are fine)
+        results = []
+        stack = [(tree, False)]
+        while stack:
+            tree, done = stack.pop()
+            if not done and tree.subTrees:
+                stack.append((tree, True))
+                stack.extend((sub, False) for sub in reversed(tree.subTrees))
+                continue
+
+            if tree.root == Operation.CONCAT:
+                # n-ary once flattened by the optimizer: chain the parts
+                parts = results[len(results) - len(tree.subTrees):]
+                del results[len(results) - len(tree.subTrees):]
+                for left, right in zip(parts, parts[1:]):
+                    left.accept_states.add_epsilon(right.start_state)
+                results.append(NFA(parts[0].start_state, parts[-1].accept_states))
+            elif tree.root == Operation.ALTERN:
+                branches = results[len(results) - len(tree.subTrees):]
+                del results[len(results) - len(tree.subTrees):]
+                start = State()
+                accept = State()
+                for branch in branches:
+                    start.add_epsilon(branch.start_state)
+                    branch.accept_states.add_epsilon(accept)
+                results.append(NFA(start, accept))
+
+            elif tree.root == Operation.ETOILE:
+                sub_nfa = results.pop()
+                start = State()
+                accept = State()
+                start.add_epsilon(sub_nfa.start_state, accept)
+                sub_nfa.accept_states.add_epsilon(sub_nfa.start_state, accept)
+                results.append(NFA(start, accept))
+
+            elif tree.root == Operation.PLUS:
+                sub_nfa = results.pop()
+                start = State()
+                accept = State()
+                start.add_epsilon(sub_nfa.start_state)
+                sub_nfa.accept_states.add_epsilon(sub_nfa.start_state, accept)
+                results.append(NFA(start, accept))
+            elif isinstance(tree.root, str):
+                # ← this is critical
+                start = State()
+                accept = State()
+                start.add_transition(tree.root, accept)
+                results.append(NFA(start, accept))
+            elif tree.root == Operation.DOT or isinstance(tree.root, CharClass):
+                start = State()
+                accept = State()
+                char_class = ANY_BUT_NEWLINE if tree.root == Operation.DOT else tree.root
+                start.add_class_transition(char_class, accept)
+                results.append(NFA(start, accept))
+
+            else:
+                raise ValueError(f"Unsupported tree node: {tree.root}")
+        return results[0]
+
+    def nfa_to_dfa(self, alphabet, search=False, max_states=None):
+        # search=True adds an implicit `.*` prefix: the start closure is
+        # re-injected after every character so a match may begin anywhere;
+        # more than `max_states` DFA states raises DFATooLarge
+        compiled = self.compiled
+        start_set = compiled.start
+        reads = [compiled.reads(char) for char in alphabet]
+        # steps are unions, so in search mode the part due to start_set (in
+        # every subset) is computed once per character
+        start_steps = [compiled.step(start_set, mask) | start_set if search else 0 for mask in reads]
+        others = ~start_set if search else -1
+        dfa_states = {start_set: State()}  # map NFA state bitsets → DFA state
+        unmarked = [start_set]  # DFA states to process
+        dfa_start = dfa_states[start_set]
 
         while unmarked:
             current_set = unmarked.pop()
             current_dfa_state = dfa_states[current_set]
 
-            for char in alphabet:
-                # find all NFA states reachable from current_set via char
-                next_set = set()
-                for nfa_state in current_set:
-                    if char in nfa_state.transitions:
-                        next_set.update(nfa_state.transitions[char])
-                next_set = epsilon_closure(next_set)
-                frozen_next = frozenset(next_set)
-                if frozen_next not in dfa_states:
-                    dfa_states[frozen_next] = State()
-                    unmarked.append(frozen_next)
+            for char, mask, start_step in zip(alphabet, reads, start_steps):
+                # all NFA states reachable from current_set via char
+                next_set = compiled.step(current_set & others, mask) | start_step
+                if not next_set:
+                    continue  # no transition: the dead state (state 0 of a DFATable)
+                if next_set not in dfa_states:
+                    if max_states is not None and len(dfa_states) >= max_states:
+                        raise DFATooLarge(f"DFA has more than {max_states} states")
+                    dfa_states[next_set] = State()
+                    unmarked.append(next_set)
                 # add DFA transition
-                current_dfa_state.add_transition(char, dfa_states[frozen_next])
+                current_dfa_state.add_transition(char, dfa_states[next_set])
 
         # determine DFA accepting states
-        dfa_accepts = {state for nfa_set, state in dfa_states.items() if self.accept_states in nfa_set}
+        dfa_accepts = {state for nfa_set, state in dfa_states.items() if nfa_set & ACCEPT}
 
         return dfa_start, dfa_accepts
 
@@ -100,8 +155,15 @@ class NFA:
             current_state = next(iter(current_state.transitions[char]))
         return current_state in dfa_accepts
 
-    def get_alphabet(nfa):
-        seen = set()
+    def get_classes(nfa):
+        """Partition every character into classes that no transition tells apart.
+
+        Returns (starts, ids, representatives): code point interval i starts
+        at starts[i] (starts[0] == 0) and belongs to class ids[i]; class 0
+        holds the characters no transition reads; representatives[cls] is
+        one character of class cls (None for class 0).
+        """
+        moves = []  # (state, label, target)
         stack = [nfa.start_state]
         visited = set()
 
@@ -112,34 +174,223 @@ class NFA:
             visited.add(state)
 
             for char, next_states in state.transitions.items():
-                seen.add(char)
+                moves.extend((state, char, target) for target in next_states)
                 stack.extend(next_states)
+            for char_class, target in state.class_transitions:
+                moves.append((state, char_class, target))
+                stack.append(target)
 
             stack.extend(state.epsilon_transitions)
 
-        return seen
+        # elementary intervals: no label starts or ends inside one of them
+        bounds = {0}
+        for _, label, _ in moves:
+            ranges = label.ranges if isinstance(label, CharClass) else [(ord(label), ord(label))]
+            for lo, hi in ranges:
+                bounds.add(lo)
+                bounds.add(hi + 1)
+        bounds = sorted(b for b in bounds if b <= MAX_CODE)
+        signatures = [set() for _ in bounds]
+        for state, label, target in moves:
+            ranges = label.ranges if isinstance(label, CharClass) else [(ord(label), ord(label))]
+            for lo, hi in ranges:
+                i = bisect_left(bounds, lo)
+                while i < len(bounds) and bounds[i] <= hi:
+                    signatures[i].add((state, target))
+                    i += 1
 
-def epsilon_closure(states):
-    """Return the set of states reachable from `states` via epsilon moves."""
-    stack = list(states)
-    closure = set(states)
-    while stack:
-        state = stack.pop()
-        for next_state in state.epsilon_transitions:
-            if next_state not in closure:
-                closure.add(next_state)
-                stack.append(next_state)
-    return closure
+        class_ids = {frozenset(): 0}
+        representatives = [None]
+        starts, ids = [], []
+        for bound, signature in zip(bounds, signatures):
+            key = frozenset(signature)
+            if key not in class_ids:
+                class_ids[key] = len(representatives)
+                representatives.append(chr(bound))
+            if not ids or ids[-1] != class_ids[key]:
+                starts.append(bound)
+                ids.append(class_ids[key])
+        return starts, ids, representatives
+
+ACCEPT = 1  # bit of the accept state in CompiledNFA state sets
+
+
+def bits(mask):
+    """Yield the indexes of the set bits of `mask`, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def follow_tables(follow):
+    """tables[k][byte] is the union of follow[i] for the bits i of `byte`
+    shifted by k * CHUNK_BITS; None when there are too many states."""
+    if len(follow) > MAX_TABLE_STATES:
+        return None
+    follow = follow + [0] * (-len(follow) % CHUNK_BITS)
+    tables = []
+    for base in range(0, len(follow), CHUNK_BITS):
+        table = [0] * (1 << CHUNK_BITS)
+        for byte in range(1, 1 << CHUNK_BITS):
+            low = byte & -byte
+            table[byte] = table[byte ^ low] | follow[base + low.bit_length() - 1]
+        tables.append(table)
+    return tables
 
-def nfa_match(nfa: 'NFA', string: str):
-    """Return True if the NFA accepts the string."""
-    current_states = epsilon_closure({nfa.start_state})
 
-    for char in string:
-        next_states = set()
-        for state in current_states:
-            if char in state.transitions:
-                next_states.update(state.transitions[char])
-        current_states = epsilon_closure(next_states)
+def follow_union(follow, tables, states):
+    """Union of follow[i] for every bit i of `states` (see follow_tables)."""
+    result = 0
+    if tables is None:
+        while states:
+            low = states & -states
+            result |= follow[low.bit_length() - 1]
+            states ^= low
+        return result
+    k = 0
+    while states:
+        byte = states & CHUNK_MASK
+        if byte:
+            result |= tables[k][byte]
+        states >>= CHUNK_BITS
+        k += 1
+    return result
 
-    return nfa.accept_states in current_states
\ No newline at end of file
+
+def closure_masks(own):
+    """Map every state of `own` (state -> bitset) to the union of the bitsets
+    of its epsilon closure.
+
+    Epsilon cycles are collapsed with Tarjan's algorithm (run with an explicit
+    stack) and each component's union reuses those of the components it
+    reaches, so a closure is never walked again from every one of its states.
+    """
+    index = {}
+    low = {}
+    on_stack = set()
+    component = []
+    closures = {}
+    for root in own:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        component.append(root)
+        on_stack.add(root)
+        work = [(root, iter(root.epsilon_transitions))]
+        while work:
+            state, successors = work[-1]
+            for succ in successors:
+                if succ not in index:
+                    index[succ] = low[succ] = len(index)
+                    component.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(succ.epsilon_transitions)))
+                    break
+                if succ in on_stack:
+                    low[state] = min(low[state], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[state])
+                if low[state] == index[state]:
+                    members = []
+                    while True:
+                        member = component.pop()
+                        on_stack.discard(member)
+                        members.append(member)
+                        if member is state:
+                            break
+                    mask = 0
+                    for member in members:
+                        mask |= own[member]
+                        for succ in member.epsilon_transitions:
+                            mask |= closures.get(succ, 0)  # finished components only
+                    for member in members:
+                        closures[member] = mask
+    return closures
+
+
+class CompiledNFA:
+    """Epsilon-free copy of an NFA with integer states and bitset state sets.
+
+    Each character transition of the State graph becomes state i >= 1
+    ("about to read labels[i]"); bit 0 (ACCEPT) stands for the accept state.
+    Epsilon closures are computed once, when the graph is compiled:
+    follow[i] is the set of states reached by reading labels[i] and
+    `start` the closure of the start state. A step is then
+        next = union of follow[i] for i in (states & reads(char))
+    with no closure to recompute and no set objects to allocate.
+
+    Each state of `tagged` also gets a bit of its own, tag_bits[k], set in
+    every closure that reaches it (a state that reads nothing); this is how
+    the accept states of several patterns are told apart.
+    """
+
+    def __init__(self, nfa: NFA, tagged=()):
+        edges = {}  # graph state -> bitset of its outgoing transitions
+        targets = [None]  # state i -> graph state reached by reading labels[i]
+        self.labels = [None]
+        stack = [nfa.start_state]
+        while stack:
+            state = stack.pop()
+            if state in edges:
+                continue
+            out = [(char, target) for char, next_states in state.transitions.items() for target in next_states]
+            out.extend(state.class_transitions)
+            edges[state] = 0
+            for label, target in out:
+                edges[state] |= 1 << len(self.labels)
+                self.labels.append(label)
+                targets.append(target)
+                stack.append(target)
+            stack.extend(state.epsilon_transitions)
+
+        own = {state: mask | (ACCEPT if state is nfa.accept_states else 0) for state, mask in edges.items()}
+        self.tag_bits = []
+        for state in tagged:
+            self.tag_bits.append(1 << len(self.labels))
+            own[state] |= self.tag_bits[-1]
+            self.labels.append(None)
+            targets.append(None)
+        closures = closure_masks(own)
+        self.start = closures[nfa.start_state]
+        self.follow = [0] + [closures.get(target, 0) for target in targets[1:]]
+        self.tables = follow_tables(self.follow)
+        self._reads = {}
+
+    @property
+    def n_states(self):
+        return len(self.labels)
+
+    def reads(self, char) -> int:
+        """Bitset of the states whose label contains `char`."""
+        mask = self._reads.get(char)
+        if mask is None:
+            mask = 0
+            if char is not None:
+                for i, label in enumerate(self.labels[1:], 1):
+                    if label is None:
+                        continue
+                    if label == char if isinstance(label, str) else char in label:
+                        mask |= 1 << i
+            self._reads[char] = mask
+        return mask
+
+    def step(self, states, reads) -> int:
+        """States reached from `states` by a character of bitset `reads`."""
+        return follow_union(self.follow, self.tables, states & reads)
+
+    def match(self, string) -> bool:
+        states = self.start
+        for char in string:
+            states = self.step(states, self.reads(char))
+            if not states:
+                return False
+        return bool(states & ACCEPT)
+
+
+def nfa_match(nfa: 'NFA', string: str):
+    """Return True if the NFA accepts the string (compiled once per NFA)."""
+    return nfa.compiled.match(string)
\ No newline at end of file
@@ -0,0 +1,252 @@
+from typing import List, Optional
+
+from astTree import RegExTree, Operation, CharClass, ANY_BUT_NEWLINE
+
+CLOSURES = (Operation.ETOILE, Operation.PLUS)
+
+
+def count_nodes(tree: RegExTree) -> int:
+    count = 0
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        count += 1
+        stack.extend(t.subTrees)
+    return count
+
+
+def _is_char(tree: RegExTree) -> bool:
+    return not tree.subTrees and (isinstance(tree.root, (str, CharClass)) or tree.root == Operation.DOT)
+
+
+def _char_ranges(tree: RegExTree):
+    if isinstance(tree.root, str):
+        return [(ord(tree.root), ord(tree.root))]
+    return (ANY_BUT_NEWLINE if tree.root == Operation.DOT else tree.root).ranges
+
+
+def _merge_chars(trees: List[RegExTree]) -> RegExTree:
+    """One leaf matching any character of the single-character `trees`."""
+    merged = CharClass([r for t in trees for r in _char_ranges(t)])
+    if len(merged.ranges) == 1 and merged.ranges[0][0] == merged.ranges[0][1]:
+        return RegExTree(chr(merged.ranges[0][0]), [])
+    return RegExTree(merged, [])
+
+
+def _operands(tree: RegExTree) -> List[RegExTree]:
+    """Operands of the chain of `tree.root` nodes rooted at `tree`, in order."""
+    operands = []
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        if t.root == tree.root and t.subTrees:
+            stack.extend(reversed(t.subTrees))
+        else:
+            operands.append(t)
+    return operands
+
+
+def _sequence(elements: List[RegExTree]) -> RegExTree:
+    return elements[0] if len(elements) == 1 else RegExTree(Operation.CONCAT, list(elements))
+
+
+class Optimizer:
+    """Rewrites a RegExTree into a smaller one matching the same strings.
+
+    - CONCAT and ALTERN nodes are flattened (n-ary),
+    - (X*)*, (X+)*, (X*)+ become X*, (X+)+ becomes X+, X*X* and X*X+ / X+X*
+      collapse to one closure, and (A|B*)* drops the inner closure,
+    - duplicate branches of an alternation are dropped, single-character
+      branches are merged into one class, and common prefixes and suffixes
+      of branches are factored out ("Sargon|Saron|Sagon" -> "Sa(rg|[gr])on").
+
+    Branch order is not kept: every engine here gives leftmost-longest
+    matches, which do not depend on it. All walks use explicit stacks.
+    """
+
+    def __init__(self):
+        self._ids = {}  # structural signature -> int
+        self._keys = {}  # id(tree) -> (tree, int); holding the tree keeps its id unique
+
+    def key(self, tree: RegExTree) -> int:
+        """Integer equal for structurally equal trees (hash-consing)."""
+        hit = self._keys.get(id(tree))
+        if hit is not None:
+            return hit[1]
+        stack = [(tree, False)]
+        while stack:
+            t, done = stack.pop()
+            if id(t) in self._keys:
+                continue
+            if t.subTrees and not done:
+                stack.append((t, True))
+                stack.extend((sub, False) for sub in t.subTrees)
+                continue
+            if isinstance(t.root, str):
+                signature = ("c", t.root)
+            elif _is_char(t):
+                signature = ("k", _char_ranges(t))
+            else:
+                signature = (t.root.value,) + tuple(self._keys[id(sub)][1] for sub in t.subTrees)
+            self._keys[id(t)] = (t, self._ids.setdefault(signature, len(self._ids)))
+        return self._keys[id(tree)][1]
+
+    def optimize(self, tree: RegExTree) -> RegExTree:
+        results = []  # optimized subtrees, in postorder
+        stack = [(tree, None)]
+        while stack:
+            t, operands = stack.pop()
+            if operands is None and t.subTrees:
+                # a chain of CONCAT (or ALTERN) nodes is handled as one n-ary node
+                operands = _operands(t) if t.root in (Operation.CONCAT, Operation.ALTERN) else t.subTrees
+                stack.append((t, operands))
+                stack.extend((sub, None) for sub in reversed(operands))
+                continue
+            if not t.subTrees:
+                results.append(t)
+                continue
+            subs = results[len(results) - len(operands):]
+            del results[len(results) - len(operands):]
+            if t.root in CLOSURES:
+                results.append(self._closure(t.root, subs[0]))
+            elif t.root == Operation.CONCAT:
+                results.append(self._concat(subs))
+            elif t.root == Operation.ALTERN:
+                results.append(self._alternation([sub.subTrees if sub.root == Operation.CONCAT else [sub]
+                                                  for sub in subs]))
+            else:
+                results.append(RegExTree(t.root, subs))
+        return results[0]
+
+    def _closure(self, root, inner: RegExTree) -> RegExTree:
+        if inner.root in CLOSURES:
+            # (X*)* = (X+)* = (X*)+ = X*, (X+)+ = X+
+            if root == Operation.ETOILE or inner.root == Operation.ETOILE:
+                root = Operation.ETOILE
+            inner = inner.subTrees[0]
+        if root == Operation.ETOILE and inner.root == Operation.ALTERN \
+                and any(b.root in CLOSURES for b in inner.subTrees):
+            # (A|B*)* = (A|B)*
+            branches = []
+            for b in inner.subTrees:
+                b = b.subTrees[0] if b.root in CLOSURES else b
+                branches.extend(b.subTrees if b.root == Operation.ALTERN else [b])
+            inner = self._alternation([b.subTrees if b.root == Operation.CONCAT else [b] for b in branches])
+        return RegExTree(root, [inner])
+
+    def _concat(self, subs: List[RegExTree]) -> RegExTree:
+        elements = []
+        for sub in subs:
+            for element in (sub.subTrees if sub.root == Operation.CONCAT else [sub]):
+                previous = elements[-1] if elements else None
+                if previous is not None and previous.root in CLOSURES and element.root in CLOSURES \
+                        and Operation.ETOILE in (previous.root, element.root) \
+                        and self.key(previous.subTrees[0]) == self.key(element.subTrees[0]):
+                    # X*X* = X*, X*X+ = X+X* = X+
+                    root = Operation.ETOILE if previous.root == element.root else Operation.PLUS
+                    elements[-1] = RegExTree(root, previous.subTrees)
+                    continue
+                elements.append(element)
+        return _sequence(elements)
+
+    def _alternation(self, branches: List[List[RegExTree]]) -> RegExTree:
+        """Tree of the alternation of `branches`, each a list of CONCAT elements.
+
+        Factoring creates nested alternations; they are built from a work
+        list, each node keeping a None slot its sub-alternation fills in.
+        """
+        holder = RegExTree(Operation.CONCAT, [None])
+        created = []
+        tasks = [(branches, holder, 0)]
+        while tasks:
+            branches, parent, index = tasks.pop()
+            node, subtasks = self._factor(branches, created)
+            parent.subTrees[index] = node
+            tasks.extend(subtasks)
+        # flatten the nodes built here, children (created later) first
+        for node in reversed(created):
+            subTrees = []
+            for sub in node.subTrees:
+                subTrees.extend(sub.subTrees if sub.root == node.root else [sub])
+            node.subTrees = subTrees
+        return holder.subTrees[0]
+
+    def _factor(self, branches, created):
+        """One level of _alternation: (node, [(branches, node, slot index)])."""
+        expanded = []
+        for branch in branches:
+            if len(branch) == 1 and branch[0].root == Operation.ALTERN:
+                expanded.extend(b.subTrees if b.root == Operation.CONCAT else [b] for b in branch[0].subTrees)
+            else:
+                expanded.append(branch)
+        unique = []
+        seen = set()
+        for branch in expanded:
+            keys = tuple(self.key(e) for e in branch)
+            if keys not in seen:
+                seen.add(keys)
+                unique.append((branch, keys))
+        if len(unique) == 1:
+            return self._node(unique[0][0], created), []
+
+        # suffix shared by all branches, each keeping at least one element
+        shortest = min(len(keys) for _, keys in unique)
+        n = 0
+        while n < shortest - 1 and len({keys[-1 - n] for _, keys in unique}) == 1:
+            n += 1
+        if n:
+            first = unique[0][0]
+            node = self._node([None] + first[len(first) - n:], created)
+            return node, [([branch[:len(branch) - n] for branch, _ in unique], node, 0)]
+
+        chars = [branch[0] for branch, _ in unique if len(branch) == 1 and _is_char(branch[0])]
+        if len(chars) > 1:
+            merged = [_merge_chars(chars)]
+            rest = [(branch, keys) for branch, keys in unique if not (len(branch) == 1 and _is_char(branch[0]))]
+            unique = [(merged, (self.key(merged[0]),))] + rest
+            if len(unique) == 1:
+                return merged[0], []
+
+        groups = {}  # first element -> branches, in order of appearance
+        for branch, keys in unique:
+            groups.setdefault(keys[0], []).append((branch, keys))
+        alternatives = []
+        subtasks = []
+        for members in groups.values():
+            shortest = min(len(keys) for _, keys in members)
+            n = 0
+            if len(members) > 1:
+                while n < shortest - 1 and len({keys[n] for _, keys in members}) == 1:
+                    n += 1
+            if n == 0:
+                # alone, or one member is only the shared element: no ε to factor into
+                alternatives.extend(self._node(branch, created) for branch, _ in members)
+                continue
+            node = self._node(members[0][0][:n] + [None], created)
+            subtasks.append(([branch[n:] for branch, _ in members], node, n))
+            alternatives.append(node)
+        if len(alternatives) == 1:
+            return alternatives[0], subtasks
+        node = RegExTree(Operation.ALTERN, alternatives)
+        created.append(node)
+        return node, subtasks
+
+    @staticmethod
+    def _node(elements, created) -> RegExTree:
+        if len(elements) == 1 and elements[0] is not None:
+            return elements[0]
+        node = RegExTree(Operation.CONCAT, list(elements))
+        created.append(node)
+        return node
+
+
+def optimize(tree: RegExTree, stats: Optional[dict] = None) -> RegExTree:
+    """Return a smaller tree matching the same strings (see Optimizer).
+
+    If `stats` is a dict it receives the node counts before and after.
+    """
+    optimized = Optimizer().optimize(tree)
+    if stats is not None:
+        stats["nodes"] = count_nodes(tree)
+        stats["optimized_nodes"] = count_nodes(optimized)
+    return optimized
@@ -0,0 +1,119 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import search
+from cache import dump_pattern, load_pattern
+from dfa import LazyDFA
+from multi import MultiPattern, compile_many
+
+DEFAULT_CHUNK_BYTES = 8 << 20  # files larger than this are split between workers
+
+_pattern = None  # compiled pattern of the worker process
+
+
+def split_file(path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Return the (start, end) byte ranges of `path`, each ending on a line boundary."""
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, "rb") as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()  # move to the end of the line we landed in
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges or [(0, 0)]
+
+
+def pattern_payload(pattern):
+    """What is sent to the workers: the serialized search table, never a State graph.
+
+    Lazy patterns have no table to ship, the workers rebuild them; so do
+    they for a MultiPattern, from its list of regexes.
+    """
+    if isinstance(pattern, MultiPattern):
+        return None, pattern.regexes, pattern.max_states
+    if isinstance(pattern, search.Pattern) and isinstance(pattern.contains_dfa, LazyDFA):
+        return None, pattern.regex, pattern.contains_dfa.max_states
+    return dump_pattern(pattern, search_only=True), pattern.regex, None
+
+
+def _init_worker(blob, regex, max_states):
+    global _pattern
+    if blob is not None:
+        _pattern = load_pattern(blob)
+    elif isinstance(regex, list):
+        _pattern = compile_many(regex, max_states)
+    else:
+        _pattern = search.compile(regex, lazy=True, max_states=max_states)
+
+
+def scan_range(pattern, path, start, end, deadline=None):
+    """(line count, [(line number in range, line)]) of the lines of the byte
+    range [start, end) of `path` containing a match of `pattern`.
+
+    Lines are returned without a trailing '\r'. Returns None without reading
+    anything once time.time() is past `deadline`; raises OSError.
+    """
+    if deadline is not None and time.time() > deadline:
+        return None
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8", errors="replace")
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()  # the range ends right after a '\n'
+    matches = []
+    if pattern.may_match(text):
+        contains = pattern.contains
+        for number, line in enumerate(lines, 1):
+            if contains(line):
+                matches.append((number, line.rstrip("\r")))
+    return len(lines), matches
+
+
+def _scan_chunk(task):
+    """Worker: scan_range of one (path, start, end) task."""
+    return scan_range(_pattern, *task)
+
+
+def _file_matches(results, n_chunks):
+    offset = 0
+    for _ in range(n_chunks):
+        n_lines, matches = next(results)
+        for number, line in matches:
+            yield offset + number, line
+        offset += n_lines
+
+
+def parallel_grep(pattern, paths, jobs=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Search `paths` with a pool of `jobs` processes (default: one per core).
+
+    The pattern is compiled once by the caller and shipped as tables. Yields
+    (path, matches) in the order of `paths`, matches iterating over
+    (line_number, line) in file order; for an unreadable file, matches is
+    the OSError instead.
+    """
+    files = []
+    tasks = []
+    for path in paths:
+        try:
+            ranges = split_file(path, chunk_bytes)
+        except OSError as e:
+            files.append((path, e))
+            continue
+        files.append((path, len(ranges)))
+        tasks.extend((path, start, end) for start, end in ranges)
+
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=pattern_payload(pattern)) as pool:
+        results = pool.map(_scan_chunk, tasks)
+        for path, n_chunks in files:
+            if isinstance(n_chunks, OSError):
+                yield path, n_chunks
+                continue
+            matches = _file_matches(results, n_chunks)
+            yield path, matches
+            for _ in matches:
+                pass  # keep `results` aligned if the caller stopped early
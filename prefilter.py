@@ -0,0 +1,144 @@
+from functools import reduce
+from typing import FrozenSet, List, Optional
+
+from astTree import RegExTree, Operation, CharClass
+
+MAX_SET = 16  # larger literal sets are dropped (too weak and too slow to test)
+MAX_GROUPS = 2  # number of literal sets checked by the prefilter
+
+ANY = frozenset([""])  # "no information": every string starts/ends with ""
+
+
+class LiteralInfo:
+    """What a subtree tells about the literals of its matches.
+
+    exact: every string the node matches (None if unknown or too many),
+    prefix/suffix: every match starts/ends with one of these strings,
+    required: sets of literals, each match contains one string of every set.
+    """
+
+    def __init__(self, exact=None, prefix=ANY, suffix=ANY, required=()):
+        self.exact = exact
+        self.prefix = exact if exact is not None else prefix
+        self.suffix = exact if exact is not None else suffix
+        self.required = list(required)
+
+    def groups(self):
+        return self.required + [self.prefix, self.suffix]
+
+
+def _cross(left, right) -> Optional[FrozenSet[str]]:
+    if len(left) * len(right) > MAX_SET:
+        return None
+    return frozenset(a + b for a in left for b in right)
+
+
+def _union(left, right) -> Optional[FrozenSet[str]]:
+    union = left | right
+    return union if len(union) <= MAX_SET else None
+
+
+def _weight(group) -> int:
+    # a set is as selective as its shortest literal
+    return min(len(s) for s in group)
+
+
+def _best(groups):
+    return max(groups, key=_weight)
+
+
+def _concat(left: LiteralInfo, right: LiteralInfo) -> LiteralInfo:
+    exact = None
+    if left.exact is not None and right.exact is not None:
+        exact = _cross(left.exact, right.exact)
+    if exact is not None:
+        return LiteralInfo(exact)
+    prefix = left.prefix
+    if left.exact is not None:
+        prefix = _cross(left.exact, right.prefix) or left.exact
+    suffix = right.suffix
+    if right.exact is not None:
+        suffix = _cross(left.suffix, right.exact) or right.exact
+    required = left.required + right.required
+    junction = _cross(left.suffix, right.prefix)
+    required += [junction] if junction is not None else [left.suffix, right.prefix]
+    return LiteralInfo(None, prefix, suffix, required)
+
+
+def _altern(left: LiteralInfo, right: LiteralInfo) -> LiteralInfo:
+    if left.exact is not None and right.exact is not None:
+        exact = _union(left.exact, right.exact)
+        if exact is not None:
+            return LiteralInfo(exact)
+    prefix = _union(left.prefix, right.prefix) or ANY
+    suffix = _union(left.suffix, right.suffix) or ANY
+    either = _union(_best(left.groups()), _best(right.groups()))
+    return LiteralInfo(None, prefix, suffix, [either] if either is not None else [])
+
+
+def node_info(t: RegExTree, subs: List[LiteralInfo]) -> LiteralInfo:
+    """LiteralInfo of node `t` given those of its subtrees."""
+    if isinstance(t.root, str):
+        return LiteralInfo(frozenset([t.root]))
+    if t.root == Operation.CONCAT:
+        return reduce(_concat, subs)
+    if t.root == Operation.ALTERN:
+        return reduce(_altern, subs)
+    if isinstance(t.root, CharClass) and len(t.root) <= MAX_SET:
+        return LiteralInfo(frozenset(t.root.chars()))
+    if t.root == Operation.PLUS:
+        return LiteralInfo(None, subs[0].prefix, subs[0].suffix, subs[0].required)
+    # ETOILE may match nothing, DOT and large classes too many chars
+    return LiteralInfo()
+
+
+def literal_info(tree: RegExTree) -> LiteralInfo:
+    """Compute the LiteralInfo of `tree` bottom-up (no recursion)."""
+    results = []
+    stack = [(tree, False)]
+    while stack:
+        t, done = stack.pop()
+        if not done and t.subTrees:
+            stack.append((t, True))
+            stack.extend((sub, False) for sub in reversed(t.subTrees))
+            continue
+        subs = results[len(results) - len(t.subTrees):]
+        del results[len(results) - len(t.subTrees):]
+        results.append(node_info(t, subs))
+    return results[0]
+
+
+def required_literals(tree: RegExTree, max_groups=MAX_GROUPS) -> List[FrozenSet[str]]:
+    """Return sets of literals such that every match contains one of each set.
+
+    The most selective sets come first; an empty list means no usable literal.
+    """
+    groups = []
+    for group in literal_info(tree).groups():
+        if group is None or "" in group:
+            continue
+        # a literal containing another one of its set adds nothing
+        group = frozenset(s for s in group if not any(t != s and t in s for t in group))
+        if group not in groups:
+            groups.append(group)
+    # drop sets implied by a stronger one (each of its literals contains one of theirs)
+    groups = [g for g in groups
+              if not any(h != g and all(any(s in t for s in g) for t in h) for h in groups)]
+    groups.sort(key=_weight, reverse=True)
+    return groups[:max_groups]
+
+
+class Prefilter:
+    """Cheap necessary condition for a match, tested with C-level `in`."""
+
+    def __init__(self, groups: List[FrozenSet[str]]):
+        self.groups = [sorted(group, key=len, reverse=True) for group in groups]
+
+    def may_match(self, text) -> bool:
+        for group in self.groups:
+            for literal in group:
+                if literal in text:
+                    break
+            else:
+                return False
+        return True
@@ -0,0 +1,212 @@
+from typing import Iterator, Optional, Tuple
+
+from astTree import RegEx, RegExTree, Operation
+from dfa import ClassMap, DFATable, LazyDFA
+from glushkov import MAX_POSITIONS, PositionAutomaton, count_positions
+from literal import LiteralPattern, literal_strings
+from nfa import NFA, DFATooLarge
+from optimize import optimize
+from prefilter import Prefilter, required_literals
+
+
+def reverse_tree(tree: RegExTree) -> RegExTree:
+    """Return the tree of the mirror regex (matches the reversed strings)."""
+    results = []  # mirrored subtrees, in postorder
+    stack = [(tree, False)]
+    while stack:
+        t, done = stack.pop()
+        if not t.subTrees:
+            results.append(t)
+        elif not done:
+            stack.append((t, True))
+            stack.extend((sub, False) for sub in reversed(t.subTrees))
+        else:
+            subTrees = results[len(results) - len(t.subTrees):]
+            del results[len(results) - len(t.subTrees):]
+            if t.root == Operation.CONCAT:
+                subTrees.reverse()
+            results.append(RegExTree(t.root, subTrees))
+    return results[0]
+
+
+def build_dfa(tree: RegExTree, search=False, minimize=False, stats=None, max_states=None) -> DFATable:
+    """tree_to_nfa -> nfa_to_dfa -> DFATable [-> minimize].
+
+    Determinization only follows one representative character per class of
+    equivalent characters, and identical table columns are merged, so rows
+    are as wide as the number of classes. If `stats` is a dict it receives
+    the DFA state and class counts. Raises DFATooLarge past `max_states`.
+    """
+    nfa = NFA.tree_to_nfa(tree)
+    starts, ids, representatives = NFA.get_classes(nfa)
+    dfa_start, dfa_accepts = nfa.nfa_to_dfa(representatives[1:], search=search, max_states=max_states)
+    classes = ClassMap(starts, ids)
+    dfa = DFATable.from_states(dfa_start, dfa_accepts, representatives[1:], search, classes)
+    dfa = dfa.merge_classes()
+    if stats is not None:
+        stats["dfa_states"] = dfa.n_states
+    if minimize:
+        dfa = dfa.minimize().merge_classes()
+        if stats is not None:
+            stats["minimized_states"] = dfa.n_states
+    if stats is not None:
+        stats["classes"] = dfa.n_classes
+    return dfa
+
+
+def build_table(tree: RegExTree, search=False, minimize=False, stats=None, max_states=10000, glushkov=False):
+    """DFA table of `tree`, or its position automaton past max_states DFA states.
+
+    Determinization is not even tried when the regex has more positions
+    than max_states: those DFAs (large alternations of words) have about
+    one state per position, and would be built to the limit only to be
+    thrown away. glushkov=True always returns the position automaton.
+    """
+    if not glushkov and (max_states is None or count_positions(tree) <= max_states):
+        try:
+            return build_dfa(tree, search, minimize, stats, max_states)
+        except DFATooLarge:
+            pass
+    return PositionAutomaton(tree, search)
+
+
+class Pattern:
+    """Compiled regex answering unanchored searches with match offsets.
+
+    Matches are leftmost-longest (as egrep). Every match start is found by a
+    single backward pass of the reversed regex's search DFA, then the end by
+    an anchored forward scan that stops at the dead state, so the text is
+    never rescanned from every offset.
+
+    Literals required by every match (see prefilter) are looked for first
+    with C-level substring tests; texts lacking them never reach a DFA.
+    With lazy=True, contains() runs on a LazyDFA bounded by `max_states`.
+    A DFA that would exceed `max_states` states is replaced by the regex's
+    bit-parallel PositionAutomaton (or by a LazyDFA for contains() when the
+    regex has more than MAX_POSITIONS positions); glushkov=True always uses
+    position automata. Automata are built from the tree shrunk by optimize.
+    """
+
+    def __init__(self, regex_str: str, minimize=False, lazy=False, max_states=10000,
+                 stats=None, tree: Optional[RegExTree] = None, glushkov=False):
+        self.regex = regex_str
+        tree = tree if tree is not None else RegEx(regex_str).parse()
+        self.minimize = minimize
+        self.max_states = max_states
+        self.glushkov = glushkov
+        groups = required_literals(tree)
+        self.tree = optimize(tree, stats)
+        self.prefilter = Prefilter(groups) if groups else None
+        if lazy:
+            self.contains_dfa = LazyDFA(NFA.tree_to_nfa(self.tree), search=True, max_states=max_states)
+        else:
+            self.contains_dfa = self._build(self.tree, True, stats)
+        if isinstance(self.contains_dfa, PositionAutomaton):
+            if self.contains_dfa.n_positions > MAX_POSITIONS and not glushkov:
+                self.contains_dfa = LazyDFA(NFA.tree_to_nfa(self.tree), search=True, max_states=max_states)
+            elif stats is not None:
+                stats["positions"] = self.contains_dfa.n_positions
+        self._anchored = None
+        self._reverse = None
+
+    @staticmethod
+    def from_tables(regex_str: str, contains_dfa, anchored, reverse, groups, max_states=10000) -> 'Pattern':
+        """Rebuild a Pattern from already compiled tables, without parsing.
+
+        `anchored` and `reverse` may be None: they are then built from the
+        regex on first use, like those of a compiled Pattern.
+        """
+        pattern = Pattern.__new__(Pattern)
+        pattern.regex = regex_str
+        pattern.tree = None
+        pattern.minimize = False
+        pattern.max_states = max_states
+        pattern.glushkov = False
+        pattern.prefilter = Prefilter(groups) if groups else None
+        pattern.contains_dfa = contains_dfa
+        pattern._anchored = anchored
+        pattern._reverse = reverse
+        return pattern
+
+    @property
+    def engine(self):
+        if isinstance(self.contains_dfa, LazyDFA):
+            return "lazy-dfa"
+        return "glushkov" if isinstance(self.contains_dfa, PositionAutomaton) else "dfa"
+
+    @property
+    def nbytes(self):
+        tables = [self.contains_dfa, self._anchored, self._reverse]
+        return sum(t.nbytes for t in tables if t is not None)
+
+    def _build(self, tree, search, stats=None):
+        return build_table(tree, search, self.minimize, stats, self.max_states, self.glushkov)
+
+    def _tree(self):
+        if self.tree is None:  # rebuilt by from_tables: parsed only when a table is missing
+            self.tree = optimize(RegEx(self.regex).parse())
+        return self.tree
+
+    @property
+    def anchored(self):
+        """Table matching whole strings (DFATable or PositionAutomaton), built on first use."""
+        if self._anchored is None:
+            self._anchored = self._build(self._tree(), False)
+        return self._anchored
+
+    def _tables(self):
+        if self._reverse is None:
+            self._reverse = self._build(reverse_tree(self._tree()), True)
+        return self.anchored, self._reverse
+
+    def may_match(self, text) -> bool:
+        """Cheap test: False only if `text` cannot contain a match."""
+        return self.prefilter is None or self.prefilter.may_match(text)
+
+    def contains(self, string) -> bool:
+        """Return True if some substring of `string` matches."""
+        if self.prefilter is not None and not self.prefilter.may_match(string):
+            return False
+        return self.contains_dfa.search(string)
+
+    def fullmatch(self, string) -> bool:
+        return self.anchored.match(string)
+
+    def finditer(self, string, pos=0) -> Iterator[Tuple[int, int]]:
+        """Yield (start, end) of every non-overlapping match from `pos` on."""
+        if not self.may_match(string[pos:]):
+            return
+        anchored, reverse = self._tables()
+        codes = anchored.encode(string)
+        starts = reverse.accepts_backward(reverse.encode(string))
+        while pos <= len(codes):
+            start = starts.find(1, pos)
+            if start < 0:
+                return
+            end = anchored.longest_match(codes, start)
+            yield start, end
+            pos = end if end > start else end + 1
+
+    def search(self, string, pos=0) -> Optional[Tuple[int, int]]:
+        """Return (start, end) of the leftmost-longest match, or None."""
+        return next(self.finditer(string, pos), None)
+
+
+def compile(regex_str: str, minimize=False, lazy=False, max_states=10000, stats=None, glushkov=False):
+    """Parse `regex_str` and return the engine best suited to it.
+
+    Plain strings and small alternations of strings get a LiteralPattern,
+    everything else a Pattern backed by DFAs, or by position automata when
+    the DFAs would exceed `max_states`; both expose the same search API.
+    If `stats` is a dict it receives the chosen engine and DFA state counts.
+    """
+    tree = RegEx(regex_str).parse()
+    literals = literal_strings(tree)
+    if literals is not None:
+        if stats is not None:
+            stats["engine"] = "literal"
+        return LiteralPattern(regex_str, literals)
+    pattern = Pattern(regex_str, minimize, lazy, max_states, stats, tree, glushkov)
+    if stats is not None:
+        stats["engine"] = pattern.engine
+    return pattern
@@ -0,0 +1,350 @@
+import argparse
+import json
+import os
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from egrep import open_input
+from index import InvertedIndex, TermQuery, iter_words, list_files
+
+MANIFEST = "segments.json"
+
+
+class Segment:
+    """An InvertedIndex and the bitmap of its deleted documents (tombstones).
+
+    Saved segments are immutable files `<name>.idx`; only their tombstones
+    (`<name>.del`) change. The in-memory buffer is a segment with no name.
+    """
+
+    def __init__(self, name: Optional[str], index: InvertedIndex, deleted: Optional[bytearray] = None):
+        self.name = name
+        self.index = index
+        self.deleted = deleted if deleted is not None else bytearray()
+        self.dirty = False  # tombstones changed since last written
+
+    def is_deleted(self, doc_id) -> bool:
+        byte = doc_id >> 3
+        return byte < len(self.deleted) and bool(self.deleted[byte] >> (doc_id & 7) & 1)
+
+    def delete(self, doc_id):
+        byte = doc_id >> 3
+        if byte >= len(self.deleted):
+            self.deleted.extend(bytes(byte + 1 - len(self.deleted)))
+        self.deleted[byte] |= 1 << (doc_id & 7)
+        self.dirty = True
+
+    def live(self) -> List[int]:
+        return [doc_id for doc_id in range(len(self.index.documents)) if not self.is_deleted(doc_id)]
+
+
+class SegmentedIndex:
+    """Word index of a directory of segments, updated without rebuilding.
+
+    New documents go to an in-memory buffer, written as a new immutable
+    segment every `max_buffered_docs` documents (or on flush). Deleting or
+    re-adding a document only sets its bit in the tombstones of the segment
+    holding it. Queries fan out over every segment and the buffer.
+
+    Segments are merged by size tier: tier k holds the segments of less
+    than max_buffered_docs * merge_factor**(k+1) live documents (and not
+    less than max_buffered_docs * merge_factor**k for k > 0); as soon as a
+    tier has `merge_factor` segments they are merged into one, dropping
+    their deleted documents. With background=True merges run in a thread
+    while documents keep being added and queried; every file is written
+    aside and swapped in with os.replace, the manifest last.
+    """
+
+    def __init__(self, directory: str, max_buffered_docs=100, merge_factor=4, background=False):
+        self.directory = directory
+        self.max_buffered_docs = max_buffered_docs
+        self.merge_factor = merge_factor
+        self.background = background
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._merger = None  # background merge thread
+        self._merging = set()  # names of the segments being merged
+        manifest = {"next": 0, "segments": []}
+        if os.path.exists(self._path(MANIFEST)):
+            with open(self._path(MANIFEST), encoding="utf-8") as f:
+                manifest = json.load(f)
+        self._next = manifest["next"]
+        self.segments = [self._open(name) for name in manifest["segments"]]
+        self.buffer = Segment(None, InvertedIndex())
+        self._locations = None  # document name -> (segment, doc id), built on first update
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open(self, name: str) -> Segment:
+        deleted = bytearray()
+        if os.path.exists(self._path(name + ".del")):
+            with open(self._path(name + ".del"), "rb") as f:
+                deleted = bytearray(f.read())
+        return Segment(name, InvertedIndex.load(self._path(name + ".idx")), deleted)
+
+    def _write(self, name: str, data: bytes):
+        temporary = self._path(name + ".tmp")
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, self._path(name))
+
+    def _new_name(self) -> str:
+        self._next += 1
+        return f"seg-{self._next:06d}"
+
+    @property
+    def locations(self) -> Dict[str, Tuple[Segment, int]]:
+        with self._lock:
+            if self._locations is None:
+                self._locations = {}
+                for segment in self.segments + [self.buffer]:
+                    for doc_id in segment.live():
+                        self._locations[segment.index.documents[doc_id]] = (segment, doc_id)
+            return self._locations
+
+    def add_document(self, name: str, words):
+        """Index `words` as document `name`, replacing any document of that name."""
+        with self._lock:
+            self.delete(name)
+            doc_id = self.buffer.index.add_document(name, words)
+            self.locations[name] = (self.buffer, doc_id)
+            full = len(self.buffer.index.documents) >= self.max_buffered_docs
+        if full:
+            self.flush()
+
+    def add_file(self, path: str):
+        with open_input(path) as stream:
+            self.add_document(path, iter_words(stream))
+
+    def delete(self, name: str) -> bool:
+        """Mark document `name` deleted; return False if it is not indexed."""
+        with self._lock:
+            location = self.locations.pop(name, None)
+            if location is None:
+                return False
+            segment, doc_id = location
+            segment.delete(doc_id)
+            return True
+
+    def flush(self):
+        """Write the buffer as a new segment, the changed tombstones and the manifest."""
+        with self._lock:
+            buffer = self.buffer
+            if buffer.live():
+                name = self._new_name()
+                buffer.index.save(self._path(name + ".idx"))
+                segment = self._open(name)
+                segment.deleted, segment.dirty = buffer.deleted, buffer.dirty
+                self.segments.append(segment)
+                if self._locations is not None:
+                    for doc_id in segment.live():
+                        self._locations[segment.index.documents[doc_id]] = (segment, doc_id)
+            self.buffer = Segment(None, InvertedIndex())
+            self._commit()
+        self.maybe_merge()
+
+    def _commit(self, removed=()):
+        for segment in self.segments:
+            if segment.dirty:
+                self._write(segment.name + ".del", bytes(segment.deleted))
+                segment.dirty = False
+        manifest = {"next": self._next, "segments": [segment.name for segment in self.segments]}
+        self._write(MANIFEST, json.dumps(manifest).encode("utf-8"))
+        # the replaced files are only removed once the manifest no longer names them;
+        # open mappings of them stay valid until their last reader drops them
+        for name in removed:
+            for suffix in (".idx", ".del"):
+                if os.path.exists(self._path(name + suffix)):
+                    os.remove(self._path(name + suffix))
+
+    def _tier(self, segment: Segment) -> int:
+        size = len(segment.live()) / self.max_buffered_docs
+        tier = 0
+        while size >= self.merge_factor:
+            size /= self.merge_factor
+            tier += 1
+        return tier
+
+    def _pick_merge(self) -> Optional[List[Segment]]:
+        with self._lock:
+            tiers = {}
+            for segment in self.segments:
+                if segment.name not in self._merging:
+                    tiers.setdefault(self._tier(segment), []).append(segment)
+            for tier in sorted(tiers):
+                if len(tiers[tier]) >= self.merge_factor:
+                    group = tiers[tier][:self.merge_factor]
+                    self._merging.update(segment.name for segment in group)
+                    return group
+        return None
+
+    def maybe_merge(self):
+        """Apply the merge policy, in the background thread if background=True."""
+        if not self.background:
+            self._merge_loop()
+            return
+        with self._lock:
+            if self._merger is None or not self._merger.is_alive():
+                self._merger = threading.Thread(target=self._merge_loop, daemon=True)
+                self._merger.start()
+
+    def _merge_loop(self):
+        while True:
+            group = self._pick_merge()
+            if group is None:
+                return
+            self.merge(group)
+
+    def wait_for_merges(self):
+        merger = self._merger
+        if merger is not None:
+            merger.join()
+
+    def merge(self, group: List[Segment]):
+        """Replace the segments of `group` by one holding their live documents."""
+        with self._lock:
+            snapshot = [bytes(segment.deleted) for segment in group]
+            self._merging.update(segment.name for segment in group)
+        # segments are immutable: the new one is built without holding the lock
+        merged = InvertedIndex()
+        remaps = []  # per segment: old doc id -> new doc id, -1 if deleted
+        for segment, deleted in zip(group, snapshot):
+            frozen = Segment(None, segment.index, bytearray(deleted))
+            remap = []
+            for doc_id, name in enumerate(segment.index.documents):
+                if frozen.is_deleted(doc_id):
+                    remap.append(-1)
+                else:
+                    remap.append(len(merged.documents))
+                    merged.documents.append(name)
+            remaps.append(remap)
+            for term, entries in segment.index.postings.items():
+                kept = [(remap[doc_id], positions) for doc_id, positions in entries if remap[doc_id] >= 0]
+                if kept:
+                    merged.postings.setdefault(term, []).extend(kept)
+
+        with self._lock:
+            name = self._new_name()
+            merged.save(self._path(name + ".idx"))
+            result = self._open(name)
+            # deletions made during the merge move to the new segment
+            for segment, deleted, remap in zip(group, snapshot, remaps):
+                frozen = Segment(None, segment.index, bytearray(deleted))
+                for doc_id, new_id in enumerate(remap):
+                    if new_id >= 0 and segment.is_deleted(doc_id) and not frozen.is_deleted(doc_id):
+                        result.delete(new_id)
+            position = self.segments.index(group[0])
+            names = {segment.name for segment in group}
+            self.segments = [segment for segment in self.segments if segment.name not in names]
+            if result.live():
+                self.segments.insert(position, result)
+            if self._locations is not None:
+                for doc_id in result.live():
+                    self._locations[result.index.documents[doc_id]] = (result, doc_id)
+            self._merging -= names
+            # every reader holds the lock: no one is using the old mappings
+            for segment in group:
+                segment.index.close()
+            if not result.live():
+                result.index.close()
+            self._commit(removed=names if result.live() else names | {name})
+
+    def force_merge(self):
+        """Merge every segment (and the buffer) into one."""
+        self.flush()
+        self.wait_for_merges()
+        while len(self.segments) > 1 or any(segment.deleted.count(0) != len(segment.deleted)
+                                            for segment in self.segments):
+            self.merge(list(self.segments))
+
+    def close(self):
+        """Flush the buffer and wait for running merges."""
+        self.flush()
+        self.wait_for_merges()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def documents(self) -> List[str]:
+        with self._lock:
+            return [segment.index.documents[doc_id]
+                    for segment in self.segments + [self.buffer] for doc_id in segment.live()]
+
+    def terms(self, regex_str: str) -> List[str]:
+        """Terms matched whole by `regex_str` that occur in a live document."""
+        query = TermQuery(regex_str)
+        found = set()
+        with self._lock:
+            for segment in self.segments + [self.buffer]:
+                for term in segment.index.terms(query):
+                    if term not in found and not all(segment.is_deleted(doc_id)
+                                                     for doc_id in segment.index.doc_ids(term)):
+                        found.add(term)
+        return sorted(found)
+
+    def query(self, regex_str: str) -> List[str]:
+        """Names of the live documents containing a word matched by `regex_str`."""
+        query = TermQuery(regex_str)
+        names = []
+        with self._lock:
+            for segment in self.segments + [self.buffer]:
+                names.extend(segment.index.documents[doc_id] for doc_id in segment.index.query(query)
+                             if not segment.is_deleted(doc_id))
+        return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain a segmented word index updated in place.")
+    parser.add_argument("directory", help="directory of the index segments")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="index files (directories are walked), replacing older versions")
+    add.add_argument("paths", nargs="+")
+    delete = commands.add_parser("delete", help="remove documents from the index")
+    delete.add_argument("paths", nargs="+")
+    commands.add_parser("merge", help="merge every segment into one")
+    query = commands.add_parser("query", help="print the documents containing a word matched by a regex")
+    query.add_argument("regex")
+    query.add_argument("--terms", action="store_true", help="print the matched terms instead of the documents")
+    args = parser.parse_args(argv)
+
+    try:
+        index = SegmentedIndex(args.directory)
+        if args.command == "add":
+            with index:
+                for path in args.paths:
+                    for file in (list_files(path) if os.path.isdir(path) else [path]):
+                        index.add_file(file)
+            return 0
+        if args.command == "delete":
+            with index:
+                missing = [path for path in args.paths if not index.delete(path)]
+            for path in missing:
+                print(f"{path}: not indexed", file=sys.stderr)
+            return 1 if missing else 0
+        if args.command == "merge":
+            index.force_merge()
+            print(f"{len(index.segments)} segment(s), {len(index.documents())} documents", file=sys.stderr)
+            return 0
+    except OSError as e:
+        print(f"{e.filename}: {e.strerror}", file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    try:
+        results = index.terms(args.regex) if args.terms else index.query(args.regex)
+    except Exception as e:
+        print("Error parsing regex:", e, file=sys.stderr)
+        return 2
+    for result in results:
+        print(result)
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from astTree import RegExSyntaxError
+from cache import PatternCache
+from index import InvertedIndex, TermQuery
+from parallel import scan_range, split_file
+from trigram import TrigramIndex
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 1000
+MAX_REQUEST_LINE = 8192
+MAX_HEADERS = 100
+CHUNK_BYTES = 1 << 20  # /grep work unit: a worker checks the deadline between two
+
+_cache = None  # PatternCache of a worker process
+_max_states = None
+
+
+def _init_worker(cache_dir, max_states):
+    global _cache, _max_states
+    _cache = PatternCache(directory=cache_dir)
+    _max_states = max_states
+
+
+def _grep_chunk(regex_str: str, path: str, start: int, end: int, deadline: float):
+    """Worker: parallel.scan_range of the byte range, or the OSError message."""
+    try:
+        return scan_range(_cache.compile(regex_str, max_states=_max_states), path, start, end, deadline)
+    except OSError as e:
+        return e.strerror
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout",
+           431: "Request Header Fields Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+           504: "Gateway Timeout"}
+
+
+class QueryServer:
+    """HTTP/JSON front end keeping an index, compiled patterns and workers warm.
+
+    GET /documents?q=REGEX  documents containing a word matched by REGEX
+    GET /terms?q=REGEX      the matched words themselves
+    GET /grep?q=REGEX       matching lines, scanned by the process pool in
+                            the candidate files of the trigram index (or
+                            in every document); &stream=1 sends them as
+                            chunked JSON lines as soon as they are found
+    GET /stats              cache and load counters
+    Results are paged with &offset=N&limit=M. A request must arrive within
+    `timeout` seconds, with at most MAX_HEADERS headers. Queries wait for one of
+    `max_concurrent` slots and fail with 504 after `timeout` seconds; the
+    workers give up a timed-out /grep at their next chunk of CHUNK_BYTES,
+    and its slot is only released once they have.
+    """
+
+    def __init__(self, index: InvertedIndex, trigrams: Optional[TrigramIndex] = None, jobs=None,
+                 cache_dir=None, max_states=10000, max_concurrent=16, timeout=10.0):
+        self.index = index
+        self.trigrams = trigrams
+        self.max_states = max_states
+        self.timeout = timeout
+        self.patterns = PatternCache(directory=cache_dir)  # validates /grep regexes
+        self.term_query = lru_cache(maxsize=256)(TermQuery)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(self.jobs, initializer=_init_worker, initargs=(cache_dir, max_states))
+        # fork the workers now: forked later, from a process running the
+        # event loop's executor threads, they could inherit a held lock
+        self.pool.submit(int).result()
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.started = time.time()
+        self.served = 0
+        self.active = 0
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def start(self, host="127.0.0.1", port=8080) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                try:
+                    path, params = await asyncio.wait_for(self._read_request(reader), self.timeout)
+                except asyncio.TimeoutError:
+                    raise HTTPError(408, f"request not received within {self.timeout}s")
+                await self._dispatch(path, params, writer)
+            except HTTPError as e:
+                await self._send_json(writer, {"error": str(e)}, e.status)
+            except Exception as e:  # keep serving: report, never drop the connection silently
+                await self._send_json(writer, {"error": f"{type(e).__name__}: {e}"}, 500)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            line = await reader.readline()
+            if len(line) > MAX_REQUEST_LINE:
+                raise HTTPError(400, "request line too long")
+            headers = 0
+            while (await reader.readline()).strip():
+                headers += 1  # headers are not used, only counted
+                if headers > MAX_HEADERS:
+                    raise HTTPError(431, f"more than {MAX_HEADERS} headers")
+        except ValueError:  # a line longer than the reader's buffer
+            raise HTTPError(400, "request line or header too long")
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise HTTPError(400, "malformed request line")
+        method, target, _ = parts
+        if method != "GET":
+            raise HTTPError(405, "only GET is supported")
+        url = urlsplit(target)
+        return url.path, {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+    async def _send_json(self, writer, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+    async def _dispatch(self, path, params, writer):
+        if path == "/stats":
+            await self._send_json(writer, self.stats())
+            return
+        if path not in ("/documents", "/terms", "/grep"):
+            raise HTTPError(404, f"unknown endpoint {path}")
+        regex = params.get("q")
+        if not regex:
+            raise HTTPError(400, "missing q=REGEX")
+        try:
+            offset = int(params.get("offset", 0))
+            limit = int(params.get("limit", PAGE_SIZE))
+        except ValueError:
+            raise HTTPError(400, "offset and limit must be integers")
+        if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+            raise HTTPError(400, f"need offset >= 0 and 0 < limit <= {MAX_PAGE_SIZE}")
+
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(503, "too many concurrent queries")
+        self.active += 1
+        try:
+            self.served += 1
+            if path == "/grep" and params.get("stream") == "1":
+                await self._stream_grep(regex, offset, limit, deadline, writer)
+                return
+            remaining = deadline - asyncio.get_running_loop().time()
+            try:
+                body = await asyncio.wait_for(self._query(path, regex, offset, limit, deadline), remaining)
+            except asyncio.TimeoutError:
+                raise HTTPError(504, f"query took more than {self.timeout}s")
+            await self._send_json(writer, body)
+        finally:
+            self.active -= 1
+            self.slots.release()
+
+    def _compile_term_query(self, regex) -> TermQuery:
+        try:
+            return self.term_query(regex)
+        except RegExSyntaxError as e:
+            raise HTTPError(400, f"invalid regex: {e}")
+
+    def _ranges(self, regex) -> List[Tuple[str, int, int]]:
+        """(path, start, end) of the chunks a /grep scans, in order; also
+        validates the regex for the workers. Unreadable files are skipped."""
+        try:
+            self.patterns.compile(regex, max_states=self.max_states)
+        except RegExSyntaxError as e:
+            raise HTTPError(400, f"invalid regex: {e}")
+        if self.trigrams is not None:
+            files = [self.trigrams.documents[doc_id] for doc_id in self.trigrams.candidates(regex)]
+        else:
+            files = list(self.index.documents)
+        ranges = []
+        for path in files:
+            try:
+                ranges.extend((path, start, end) for start, end in split_file(path, CHUNK_BYTES))
+            except OSError:
+                pass
+        return ranges
+
+    async def _query(self, path, regex, offset, limit, deadline) -> dict:
+        loop = asyncio.get_running_loop()
+        if path == "/grep":
+            ranges = await loop.run_in_executor(None, self._ranges, regex)
+            found = self._grep(regex, ranges, deadline)
+            matches = []
+            more = False
+            try:
+                async for match in found:
+                    if len(matches) == offset + limit:
+                        more = True
+                        break
+                    matches.append(match)
+            finally:
+                await found.aclose()  # submits nothing more, waits for the busy workers
+            return {"query": regex, "offset": offset, "results": matches[offset:], "more": more}
+        # index lookups are short: a thread keeps the event loop responsive
+        query = await loop.run_in_executor(None, self._compile_term_query, regex)
+        if path == "/terms":
+            results = await loop.run_in_executor(None, self.index.terms, query)
+        else:
+            doc_ids = await loop.run_in_executor(None, self.index.query, query)
+            results = [self.index.documents[doc_id] for doc_id in doc_ids]
+        return {"query": regex, "offset": offset, "total": len(results), "results": results[offset:offset + limit]}
+
+    async def _grep(self, regex, ranges, deadline):
+        """Yield the matches in the chunks `ranges`, in order; the pool scans
+        up to two chunks per worker ahead of the one being read, and gives
+        up past `deadline` (event loop time) with asyncio.TimeoutError.
+
+        Chunks are only submitted as the matches are consumed. Closing the
+        generator cancels the chunks not started and waits for the others,
+        so that the pool is free again when it returns.
+        """
+        loop = asyncio.get_running_loop()
+        stop = time.time() + deadline - loop.time()  # the workers' clock
+        window = 2 * self.jobs
+        pending = deque()  # (path, start, concurrent future)
+        i = 0
+        skipped = None  # unreadable file
+        line_offset = 0
+        try:
+            while pending or i < len(ranges):
+                while i < len(ranges) and len(pending) < window:
+                    path, start, end = ranges[i]
+                    pending.append((path, start, self.pool.submit(_grep_chunk, regex, path, start, end, stop)))
+                    i += 1
+                path, start, future = pending[0]
+                result = await asyncio.wrap_future(future)
+                pending.popleft()
+                if result is None:
+                    raise asyncio.TimeoutError
+                if start == 0:
+                    skipped, line_offset = None, 0
+                if isinstance(result, str):
+                    skipped = path
+                if path == skipped:
+                    continue
+                n_lines, matches = result
+                for number, line in matches:
+                    yield {"path": path, "line_number": line_offset + number, "line": line}
+                line_offset += n_lines
+        finally:
+            running = [future for _, _, future in pending if not future.cancel()]
+            if running:
+                await asyncio.wait([asyncio.wrap_future(future) for future in running])
+
+    async def _stream_grep(self, regex, offset, limit, deadline, writer):
+        loop = asyncio.get_running_loop()
+        # before the headers go out, so that a bad regex still gets its 400
+        ranges = await loop.run_in_executor(None, self._ranges, regex)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+
+        async def send(body):
+            data = json.dumps(body).encode("utf-8") + b"\n"
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+            await writer.drain()
+
+        matches = self._grep(regex, ranges, deadline)
+        index = 0
+        try:
+            while index < offset + limit:
+                remaining = deadline - loop.time()
+                try:
+                    match = await asyncio.wait_for(matches.__anext__(), max(remaining, 0))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    await send({"error": f"query took more than {self.timeout}s"})
+                    break
+                if index >= offset:
+                    await send(match)
+                index += 1
+        except ConnectionError:
+            raise
+        except Exception as e:  # the 200 is out: end the body with the error, not a second response
+            await send({"error": f"{type(e).__name__}: {e}"})
+        finally:
+            await matches.aclose()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def stats(self) -> dict:
+        return {"documents": len(self.index.documents), "uptime": round(time.time() - self.started, 3),
+                "served": self.served, "active": self.active,
+                "pattern_cache": {"hits": self.patterns.hits, "misses": self.patterns.misses,
+                                  "disk_hits": self.patterns.disk_hits, "bytes": self.patterns.size},
+                "term_query_cache": self.term_query.cache_info()._asdict()}
+
+
+async def serve(server: QueryServer, host, port):
+    listener = await server.start(host, port)
+    addresses = ", ".join(str(sock.getsockname()) for sock in listener.sockets)
+    print(f"serving on {addresses}", file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve regex queries over an index as HTTP/JSON.")
+    parser.add_argument("index", help="word index file written by 'index.py build'")
+    parser.add_argument("--trigrams", help="trigram index file restricting the files /grep scans")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes for /grep (default: one per core)")
+    parser.add_argument("--cache-dir", help="directory of compiled patterns shared by the workers and restarts")
+    parser.add_argument("--max-states", type=int, default=10000, help="DFA state budget of compiled patterns")
+    parser.add_argument("--max-concurrent", type=int, default=16, help="queries served at once")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds allowed per query")
+    args = parser.parse_args(argv)
+
+    try:
+        index = InvertedIndex.load(args.index)
+        trigrams = TrigramIndex.load(args.trigrams) if args.trigrams else None
+    except OSError as e:
+        print(f"{e.filename}: {e.strerror}", file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    async def run():
+        server = QueryServer(index, trigrams, args.jobs, args.cache_dir, args.max_states,
+                             args.max_concurrent, args.timeout)
+        try:
+            await serve(server, args.host, args.port)
+        finally:
+            server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import argparse
+import hashlib
+import random
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from index import InvertedIndex, RANK_SUFFIX, save_scores
+
+PRIME = (1 << 61) - 1  # hash functions are h(x) = (a * x + b) mod PRIME
+N_HASHES = 128
+BANDS = 32  # LSH: signatures cut in BANDS bands of N_HASHES // BANDS rows
+THRESHOLD = 0.3  # estimated Jaccard similarity kept as a graph edge
+MAX_BUCKET = 1000  # larger LSH buckets are too common to tell anything
+
+
+def _term_hash(term: str) -> int:
+    # stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def minhash_signatures(index: InvertedIndex, n_hashes=N_HASHES, seed=0) -> List[Optional[List[int]]]:
+    """MinHash signature of every document's set of terms (None for an empty one).
+
+    Read from the postings in one pass: each term's n_hashes values are
+    computed once and min-ed into the signatures of its documents, so no
+    text is read and no per-document term set is built.
+    """
+    rng = random.Random(seed)
+    coefficients = [(rng.randrange(1, PRIME), rng.randrange(PRIME)) for _ in range(n_hashes)]
+    signatures = [None] * len(index.documents)
+    for term, doc_ids in index.iter_doc_ids():
+        x = _term_hash(term)
+        values = [(a * x + b) % PRIME for a, b in coefficients]
+        for doc_id in doc_ids:
+            signature = signatures[doc_id]
+            signatures[doc_id] = values if signature is None else list(map(min, signature, values))
+    return signatures
+
+
+def candidate_pairs(signatures, bands=BANDS, max_bucket=MAX_BUCKET) -> Set[Tuple[int, int]]:
+    """Pairs of documents whose signatures agree on at least one whole band.
+
+    Two documents of Jaccard similarity s agree on a band of r rows with
+    probability s**r, so similar pairs are found without comparing all
+    N**2 pairs.
+    """
+    n_hashes = len(next((s for s in signatures if s is not None), ()))
+    rows = n_hashes // bands
+    pairs = set()
+    for band in range(bands):
+        lo = band * rows
+        buckets: Dict[tuple, List[int]] = {}
+        for doc_id, signature in enumerate(signatures):
+            if signature is not None:
+                buckets.setdefault(tuple(signature[lo:lo + rows]), []).append(doc_id)
+        for doc_ids in buckets.values():
+            if 1 < len(doc_ids) <= max_bucket:
+                for i, a in enumerate(doc_ids):
+                    pairs.update((a, b) for b in doc_ids[i + 1:])
+    return pairs
+
+
+def similarity_graph(signatures, pairs, threshold=THRESHOLD) -> List[Tuple[int, int, float]]:
+    """Edges (a, b, estimated Jaccard similarity) of the candidate pairs above `threshold`."""
+    edges = []
+    for a, b in sorted(pairs):
+        sa, sb = signatures[a], signatures[b]
+        similarity = sum(x == y for x, y in zip(sa, sb)) / len(sa)
+        if similarity >= threshold:
+            edges.append((a, b, similarity))
+    return edges
+
+
+def pagerank(n: int, edges, damping=0.85, tolerance=1e-10, max_iterations=100) -> List[float]:
+    """PageRank of the undirected weighted graph: a walker follows an edge with
+    probability proportional to its weight; isolated nodes jump anywhere."""
+    if n == 0:
+        return []
+    degree = [0.0] * n
+    for a, b, weight in edges:
+        degree[a] += weight
+        degree[b] += weight
+    isolated = [i for i in range(n) if not degree[i]]
+    rank = [1.0 / n] * n
+    for _ in range(max_iterations):
+        base = (1 - damping) / n + damping * sum(rank[i] for i in isolated) / n
+        new = [base] * n
+        for a, b, weight in edges:
+            new[b] += damping * rank[a] * weight / degree[a]
+            new[a] += damping * rank[b] * weight / degree[b]
+        delta = sum(abs(x - y) for x, y in zip(new, rank))
+        rank = new
+        if delta < tolerance:
+            break
+    return rank
+
+
+def rank_documents(index: InvertedIndex, n_hashes=N_HASHES, bands=BANDS, threshold=THRESHOLD,
+                   stats: Optional[dict] = None) -> List[float]:
+    """PageRank of each document in the graph of its near duplicates (MinHash + LSH)."""
+    signatures = minhash_signatures(index, n_hashes)
+    pairs = candidate_pairs(signatures, bands)
+    edges = similarity_graph(signatures, pairs, threshold)
+    if stats is not None:
+        stats["candidate_pairs"] = len(pairs)
+        stats["edges"] = len(edges)
+    return pagerank(len(index.documents), edges)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=f"Score the documents of an index by centrality in their similarity graph (writes INDEX{RANK_SUFFIX}).")
+    parser.add_argument("index", help="index file written by 'index.py build'")
+    parser.add_argument("--hashes", type=int, default=N_HASHES, help="MinHash signature length")
+    parser.add_argument("--bands", type=int, default=BANDS, help="LSH bands (hashes / bands rows each)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="minimal similarity of an edge")
+    parser.add_argument("--top", type=int, default=10, help="print the best scored documents")
+    args = parser.parse_args(argv)
+    if args.bands < 1 or args.hashes % args.bands:
+        parser.error("--hashes must be a multiple of --bands")
+
+    try:
+        index = InvertedIndex.load(args.index)
+    except OSError as e:
+        print(f"{e.filename}: {e.strerror}", file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    stats = {}
+    scores = rank_documents(index, args.hashes, args.bands, args.threshold, stats)
+    save_scores(args.index, scores)
+    print(f"{len(scores)} documents, {stats['candidate_pairs']} candidate pairs, {stats['edges']} edges",
+          file=sys.stderr)
+    for doc_id in sorted(range(len(scores)), key=lambda doc_id: -scores[doc_id])[:args.top]:
+        print(f"{scores[doc_id]:.6f} {index.documents[doc_id]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Tuple
+
+from astTree import MAX_CODE
+
+
+def _successor(prefix: str):
+    """Smallest string greater than every string starting with `prefix` (None if none)."""
+    prefix = prefix.rstrip(chr(MAX_CODE))
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class TermDictionary:
+    """Sorted vocabulary walked as a trie.
+
+    The terms are kept sorted with lcp[i], the length of the prefix term i
+    shares with term i - 1: the node of the trie at depth d above term i is
+    the run of neighbours sharing its first d characters. An automaton is
+    run down this implicit trie (see walk), one step per trie edge rather
+    than per character of every term.
+    """
+
+    def __init__(self, terms: Iterable[str], lcp=None):
+        """`terms` are sorted here unless `lcp` (for already sorted terms) is given.
+
+        Any sequences will do for sorted terms and their lcp, such as the
+        memory-mapped tables of an IndexFile.
+        """
+        if lcp is not None:
+            self.terms, self.lcp = terms, lcp
+            return
+        self.terms: List[str] = sorted(terms)
+        self.lcp = array('I', [0]) * len(self.terms)
+        previous = ""
+        for i, term in enumerate(self.terms):
+            n = 0
+            limit = min(len(term), len(previous))
+            while n < limit and term[n] == previous[n]:
+                n += 1
+            self.lcp[i] = n
+            previous = term
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __getitem__(self, i) -> str:
+        return self.terms[i]
+
+    def __contains__(self, term) -> bool:
+        i = bisect_left(self.terms, term)
+        return i < len(self.terms) and self.terms[i] == term
+
+    def prefix_range(self, prefix: str, lo=0) -> Tuple[int, int]:
+        """(lo, hi) such that terms[lo:hi] are the terms starting with `prefix`."""
+        lo = bisect_left(self.terms, prefix, lo)
+        successor = _successor(prefix)
+        hi = bisect_left(self.terms, successor, lo) if successor is not None else len(self.terms)
+        return lo, hi
+
+    def walk(self, automaton, lo=0, hi=None) -> Iterator[int]:
+        """Yield the indexes in [lo, hi) of the terms `automaton` accepts.
+
+        `automaton` is an anchored DFATable or PositionAutomaton (start,
+        encode, step, accepts; state 0 is dead). The states reached on the
+        prefixes of the current term are kept on a stack, so a term only
+        steps past its common prefix with the previous one; when a prefix
+        leads to the dead state, every term starting with it is skipped
+        with one binary search.
+        """
+        terms, lcp = self.terms, self.lcp
+        hi = len(terms) if hi is None else hi
+        step, accepts, encode = automaton.step, automaton.accepts, automaton.encode
+        states = [automaton.start]  # states[d]: state after the first d characters
+        i = lo
+        while i < hi:
+            term = terms[i]
+            depth = min(lcp[i], len(states) - 1) if i > lo else 0
+            del states[depth + 1:]
+            state = states[-1]
+            for cls in encode(term[depth:]):
+                state = step(state, cls)
+                if not state:
+                    break
+                states.append(state)
+            if state:
+                if accepts(state):
+                    yield i
+                i += 1
+                continue
+            # terms[i][:len(states)] leads nowhere: skip all the terms starting with it
+            successor = _successor(term[:len(states)])
+            i = bisect_left(terms, successor, i + 1, hi) if successor is not None else hi
+
+    def expand(self, automaton, prefixes=("",)) -> List[str]:
+        """Terms accepted by `automaton`, each starting with one of `prefixes`.
+
+        Only the ranges of terms starting with a prefix are walked (a range
+        scan when the regex has a literal prefix).
+        """
+        found = []
+        covered = 0
+        for prefix in sorted(prefixes):
+            lo, hi = self.prefix_range(prefix)
+            lo = max(lo, covered)  # a prefix of a previous one already covered its range
+            if lo < hi:
+                found.extend(self.terms[i] for i in self.walk(automaton, lo, hi))
+                covered = hi
+        return found
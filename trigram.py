@@ -0,0 +1,228 @@
+import argparse
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+import search
+from astTree import RegEx, RegExTree, Operation
+from egrep import grep_files, iter_blocks, open_input
+from index import list_files
+from indexfile import IndexFile, write_index
+from prefilter import node_info
+
+# A query is a trigram (a 3-character str), ("and", queries), ("or", queries),
+# or None: no constraint, every document is a candidate.
+
+
+def _and(queries: Iterable) -> Optional[tuple]:
+    terms = []
+    for q in queries:
+        if q is None:
+            continue
+        for term in (q[1] if isinstance(q, tuple) and q[0] == "and" else [q]):
+            if term not in terms:
+                terms.append(term)
+    if not terms:
+        return None
+    return terms[0] if len(terms) == 1 else ("and", tuple(terms))
+
+
+def _or(queries: Iterable) -> Optional[tuple]:
+    terms = []
+    for q in queries:
+        if q is None:
+            return None  # one branch may match anywhere
+        for term in (q[1] if isinstance(q, tuple) and q[0] == "or" else [q]):
+            if term not in terms:
+                terms.append(term)
+    if not terms:
+        return None
+    return terms[0] if len(terms) == 1 else ("or", tuple(terms))
+
+
+def literal_query(literal: str):
+    """Every document containing `literal` has all of its trigrams."""
+    return _and(literal[i:i + 3] for i in range(len(literal) - 2))
+
+
+def set_query(literals):
+    """A document containing one of `literals` (None: unknown) matches this."""
+    if literals is None or any(len(literal) < 3 for literal in literals):
+        return None
+    return _or(literal_query(literal) for literal in sorted(literals))
+
+
+def plan(tree: RegExTree):
+    """Trigram query every document holding a match of `tree` satisfies.
+
+    Built bottom-up: a node requires the trigrams of the literals its
+    LiteralInfo guarantees (see prefilter.node_info), AND those of its
+    subtrees for a concatenation or OR those of its branches for an
+    alternation; X* and the character wildcards require nothing.
+    """
+    results = []  # (LiteralInfo, query) of finished subtrees
+    stack = [(tree, False)]
+    while stack:
+        t, done = stack.pop()
+        if not done and t.subTrees:
+            stack.append((t, True))
+            stack.extend((sub, False) for sub in reversed(t.subTrees))
+            continue
+        subs = results[len(results) - len(t.subTrees):]
+        del results[len(results) - len(t.subTrees):]
+        info = node_info(t, [sub_info for sub_info, _ in subs])
+        if info.exact is not None:
+            # every match is one of these strings: the subtrees add nothing
+            results.append((info, set_query(info.exact)))
+            continue
+        queries = [set_query(group) for group in info.groups()]
+        if t.root in (Operation.CONCAT, Operation.PLUS):
+            queries.extend(query for _, query in subs)
+        elif t.root == Operation.ALTERN:
+            queries.append(_or(query for _, query in subs))
+        results.append((info, _and(queries)))
+    return results[0][1]
+
+
+def trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """For each 3-character string of the corpus, the documents containing it.
+
+    postings[trigram] is an array of increasing doc ids. A regex query is
+    turned into a boolean trigram query (see plan) and only the documents
+    satisfying it are scanned, in the style of Google Code Search.
+    """
+
+    def __init__(self):
+        self.documents = []  # doc id -> path
+        self.postings: Dict[str, array] = {}
+
+    def add_document(self, name: str, blocks: Iterable[str]) -> int:
+        """Index the text given as `blocks` (cut at line ends) as a new document."""
+        doc_id = len(self.documents)
+        self.documents.append(name)
+        seen = set()
+        for text in blocks:
+            seen |= trigrams(text)
+        postings = self.postings
+        for trigram in seen:
+            if trigram not in postings:
+                postings[trigram] = array('I')
+            postings[trigram].append(doc_id)
+        return doc_id
+
+    def add_file(self, path: str) -> int:
+        with open_input(path) as stream:
+            return self.add_document(path, (text for text, _ in iter_blocks(stream)))
+
+    @classmethod
+    def from_directory(cls, directory: str) -> 'TrigramIndex':
+        index = cls()
+        for path in list_files(directory):
+            index.add_file(path)
+        return index
+
+    def evaluate(self, query) -> List[int]:
+        """Sorted ids of the documents satisfying `query`."""
+        if query is None:
+            return list(range(len(self.documents)))
+        results = []  # sets of doc ids of finished subqueries
+        stack = [(query, False)]
+        while stack:
+            q, done = stack.pop()
+            if isinstance(q, str):
+                results.append(set(self.postings.get(q, ())))
+            elif not done:
+                stack.append((q, True))
+                stack.extend((sub, False) for sub in q[1])
+            else:
+                subs = results[len(results) - len(q[1]):]
+                del results[len(results) - len(q[1]):]
+                if q[0] == "and":
+                    subs.sort(key=len)  # intersect the smallest sets first
+                    results.append(subs[0].intersection(*subs[1:]))
+                else:
+                    results.append(set().union(*subs))
+        return sorted(results[0])
+
+    def candidates(self, regex_str: str) -> List[int]:
+        """Ids of the documents that may contain a match of `regex_str`."""
+        return self.evaluate(plan(RegEx(regex_str).parse()))
+
+    def grep(self, regex_str: str, doc_ids=None):
+        """Yield (path, matches) like egrep.grep_files, over the candidate documents only.
+
+        `doc_ids` are the candidates when the caller already evaluated them.
+        """
+        pattern = search.compile(regex_str)
+        if doc_ids is None:
+            doc_ids = self.candidates(regex_str)
+        yield from grep_files(pattern, [self.documents[doc_id] for doc_id in doc_ids])
+
+    def save(self, path: str):
+        write_index(path, self.documents, self.postings, positions=False)
+
+    @classmethod
+    def load(cls, path: str) -> 'TrigramIndex':
+        """Open a saved index read-only; its tables stay in the mapped file (see IndexFile)."""
+        index = cls()
+        index.postings = IndexFile(path)
+        index.documents = index.postings.documents
+        return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a trigram index of a corpus, or grep only its candidate files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index every file under a directory")
+    build.add_argument("directory")
+    build.add_argument("-o", "--output", required=True, help="index file to write")
+    query = commands.add_parser("query", help="print the lines matching a regex in the candidate files")
+    query.add_argument("index", help="index file written by 'build'")
+    query.add_argument("regex")
+    query.add_argument("-l", "--files-with-matches", action="store_true", help="only print the names of matching files")
+    query.add_argument("--stats", action="store_true", help="print the trigram query and candidate count on stderr")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "build":
+            index = TrigramIndex.from_directory(args.directory)
+            index.save(args.output)
+            print(f"{len(index.documents)} documents, {len(index.postings)} trigrams", file=sys.stderr)
+            return 0
+        index = TrigramIndex.load(args.index)
+    except OSError as e:
+        print(f"{e.filename}: {e.strerror}", file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    try:
+        query = plan(RegEx(args.regex).parse())
+    except Exception as e:
+        print("Error parsing regex:", e, file=sys.stderr)
+        return 2
+    doc_ids = index.evaluate(query)
+    if args.stats:
+        print(f"query: {query}", file=sys.stderr)
+        print(f"{len(doc_ids)} of {len(index.documents)} documents scanned", file=sys.stderr)
+
+    found = False
+    for path, matches in index.grep(args.regex, doc_ids):
+        if isinstance(matches, OSError):
+            print(f"{path}: {matches.strerror}", file=sys.stderr)
+            continue
+        for _, line in matches:
+            found = True
+            if args.files_with_matches:
+                print(path)
+                break
+            print(f"{path}:{line}")
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())